@@ -0,0 +1,64 @@
+"""
+Import time benchmark for wanglab_instruments.
+
+Imports the package in fresh interpreters and fails (exit status 1) if the
+median import time goes over budget, or if importing the package pulls in
+heavy dependencies that should only be loaded on first use.
+
+Usage:
+    python benchmarks/import_time.py [budget_ms]
+"""
+from __future__ import print_function
+import os
+import subprocess
+import sys
+
+# Modules that must not be imported by `import wanglab_instruments`
+HEAVY = ('numpy', 'scipy', 'matplotlib', 'visa', 'pyvisa', 'serial')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import sys, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(1000*(t1 - t0), ','.join(heavy))
+'''
+
+def import_time(module='wanglab_instruments', repeat=7):
+    """
+    import_time(module='wanglab_instruments', repeat=7)
+
+    Time `import module` in repeat fresh interpreters.
+
+    Returns:
+        tuple : (median import time in ms, list of heavy modules imported)
+    """
+    times = []
+    heavy = []
+    for i in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c', CHILD.format(module=module, heavy=HEAVY)],
+            cwd=ROOT).decode().split()
+        times.append(float(out[0]))
+        if len(out) > 1:
+            heavy = out[1].split(',')
+    times.sort()
+    return times[len(times)//2], heavy
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 30.
+    failed = False
+    for module in ('wanglab_instruments', 'wanglab_instruments.instruments',
+                   'wanglab_instruments.utils'):
+        ms, heavy = import_time(module)
+        print('{}: {:.1f} ms'.format(module, ms))
+        if ms > budget:
+            print('  over budget of {} ms'.format(budget))
+            failed = True
+        if heavy:
+            print('  imported {} eagerly'.format(', '.join(heavy)))
+            failed = True
+    sys.exit(1 if failed else 0)
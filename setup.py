@@ -9,5 +9,6 @@ setup(
     url = 'https://github.com/mckuzyk/wanglab_instruments.git',
     download_url = 'https://github.com/mckuzyk/wanglab_instruments/archive/0.1..tar.gz',
     keywords = ['wanglab'],
+    python_requires = '>=3.7',
     classifiers = [],
     )
@@ -0,0 +1,22 @@
+# Everything is imported on first use so that `import wanglab_instruments`
+# stays fast for services that only need one or two drivers.  The driver
+# modules are also available directly, e.g. wanglab_instruments.oscilloscopes.
+import importlib
+
+_subpackages = ('instruments', 'utils')
+_drivers = ('oscilloscopes', 'spectrum_analyzers', 'lockins',
+            'function_generators')
+
+def __getattr__(name):
+    if name in _subpackages:
+        module = importlib.import_module('.' + name, __name__)
+    elif name in _drivers:
+        module = importlib.import_module('.instruments.' + name, __name__)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+    globals()[name] = module
+    return module
+
+def __dir__():
+    return sorted(set(globals()) | set(_subpackages) | set(_drivers))
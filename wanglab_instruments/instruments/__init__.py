@@ -1,4 +1,19 @@
-from . import oscilloscopes
-from . import spectrum_analyzers
-from . import lockins
-from . import function_generators
+# Driver modules are imported on first use, e.g. the first access to
+# wanglab_instruments.instruments.oscilloscopes, so that using one driver does
+# not pay for importing all of them and their dependencies.
+import importlib
+
+_submodules = ('oscilloscopes', 'spectrum_analyzers', 'lockins',
+               'function_generators', 'snapshot', 'session', 'transports',
+               'binblock', 'trace')
+
+def __getattr__(name):
+    if name in _submodules:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
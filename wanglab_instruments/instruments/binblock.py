@@ -0,0 +1,177 @@
+import numpy as np
+from . import session
+
+###################### IEEE 488.2 binary blocks ###############################
+#
+# Instruments send binary data as a block: '#', one digit n, n digits giving
+# the number of data bytes, then the data (definite length), or '#0' followed
+# by data up to the final newline (indefinite length).  The functions here
+# decode blocks for every driver.  Values are received straight into a numpy
+# array, and a caller-supplied array is reused when it is large enough, so
+# repeated fetches of the same size allocate nothing.
+
+def block_dtype(datatype, is_big_endian=False):
+    """
+    block_dtype(datatype, is_big_endian=False)
+
+    numpy dtype of the values in a block.
+
+    Args:
+        datatype (str or dtype) : struct format character, e.g. 'f' (float32),
+            'd' (float64), 'h' (int16), 'b' (int8), or a numpy dtype
+        is_big_endian (bool, optional) : byte order of the values
+
+    Returns:
+        numpy.dtype : dtype with explicit byte order
+    """
+    dtype = np.dtype(datatype)
+    if dtype.itemsize == 1:
+        return dtype
+    return dtype.newbyteorder('>' if is_big_endian else '<')
+
+def parse_header(data, start=0):
+    """
+    parse_header(data, start=0)
+
+    Locate the data of a block held in memory.
+
+    Args:
+        data (bytes-like) : buffer holding the block
+        start (int, optional) : position of the '#' starting the block
+
+    Returns:
+        tuple : (offset of the first data byte, number of data bytes).  The
+            number of bytes is None for an indefinite length block.
+    """
+    data = memoryview(data).cast('B')
+    if data[start] != ord('#'):
+        raise ValueError('Expected binary block, got {!r}'.format(
+            bytes(data[start:start + 12])))
+    digits = int(bytes(data[start + 1:start + 2]))
+    if digits == 0:
+        return start + 2, None
+    return start + 2 + digits, int(bytes(data[start + 2:start + 2 + digits]))
+
+def _output(out, count, dtype, out_dtype):
+    # Array the caller gets back: out[:count] if out can hold the values,
+    # else a new array
+    if out is not None and len(out) >= count:
+        return out[:count]
+    if out_dtype is None:
+        out_dtype = dtype.newbyteorder('=')
+    return np.empty(count, dtype=out_dtype)
+
+def decode_block(data, datatype='f', is_big_endian=False, out=None,
+        dtype=None, start=0):
+    """
+    decode_block(data, datatype='f', is_big_endian=False, out=None,
+        dtype=None, start=0)
+
+    Values of a block held in memory, e.g. a response read with read_raw.
+
+    Args:
+        data (bytes-like) : buffer holding the block
+        datatype (str, optional) : struct format character of the values
+        is_big_endian (bool, optional) : byte order of the values
+        out (array, optional) : array to receive the values, reused if it is
+            large enough.  A view of its first values is returned.
+        dtype (optional) : dtype of the returned values when out isn't used.
+            Defaults to datatype in native byte order.
+        start (int, optional) : position of the '#' starting the block
+
+    Returns:
+        array : the values
+    """
+    block = block_dtype(datatype, is_big_endian)
+    offset, nbytes = parse_header(data, start)
+    if nbytes is None:
+        nbytes = len(memoryview(data).cast('B')) - offset
+    count = nbytes//block.itemsize
+    values = np.frombuffer(data, dtype=block, count=count, offset=offset)
+    result = _output(out, count, block, dtype)
+    result[...] = values
+    return result
+
+def _read_into(inst, arr):
+    # Receive exactly arr.nbytes bytes into arr
+    if isinstance(inst, session.LockedResource):
+        session.read_chunked(inst, arr.nbytes, out=arr)
+    elif hasattr(inst, 'read_into'):
+        inst.read_into(arr)
+    else:
+        memoryview(arr).cast('B')[:] = inst.read_bytes(arr.nbytes)
+
+def read_block(inst, datatype='f', is_big_endian=False, out=None, dtype=None,
+        expect_termination=True):
+    """
+    read_block(inst, datatype='f', is_big_endian=False, out=None, dtype=None,
+        expect_termination=True)
+
+    Read a block that the instrument is about to send, after a query was
+    written.  When out (or the returned array) has the block's dtype the data
+    is received directly into it, otherwise it is converted in one step.  A
+    LockedResource is read with session.read_chunked, so other instruments on
+    the bus aren't held up by a long transfer.
+
+    Args:
+        inst (object) : communication object with a read_bytes method,
+            typically a pyVisa Resource
+        datatype (str, optional) : struct format character of the values.
+            Default 'f' (float32).
+        is_big_endian (bool, optional) : byte order of the values
+        out (array, optional) : array to receive the values, reused if it is
+            large enough.  A view of its first values is returned.
+        dtype (optional) : dtype of the returned values when out isn't used.
+            Defaults to datatype in native byte order.
+        expect_termination (bool, optional) : consume the newline following
+            the block
+
+    Returns:
+        array : the values
+    """
+    block = block_dtype(datatype, is_big_endian)
+    with session.reserve(inst):
+        with session.transaction(inst, session.BULK):
+            head = bytes(inst.read_bytes(2))
+            if head[:1] != b'#':
+                raise ValueError('Expected binary block, got {!r}'.format(
+                    head))
+            digits = int(head[1:2])
+            if digits == 0:
+                # Indefinite length, the data runs up to the final newline
+                data = bytes(inst.read_raw())
+                if data.endswith(b'\n'):
+                    data = data[:-1]
+                data = data[:len(data) - len(data) % block.itemsize]
+                return decode_block(b'#0' + data, datatype, is_big_endian,
+                    out, dtype)
+            nbytes = int(inst.read_bytes(digits))
+        count = nbytes//block.itemsize
+        result = _output(out, count, block, dtype)
+        if result.dtype == block and result.flags.c_contiguous:
+            _read_into(inst, result)
+        else:
+            raw = np.empty(count, dtype=block)
+            _read_into(inst, raw)
+            result[...] = raw
+        if expect_termination:
+            inst.read_bytes(1)
+    return result
+
+def query_block(inst, command, datatype='f', is_big_endian=False, out=None,
+        dtype=None, expect_termination=True):
+    """
+    query_block(inst, command, datatype='f', is_big_endian=False, out=None,
+        dtype=None, expect_termination=True)
+
+    Send a query and read the block it returns, see read_block.
+
+    Examples:
+        >>> buf = np.empty(801, dtype=np.float32)
+        >>> for i in range(1000):
+        ...     y = query_block(rsa.inst, 'FETCH:SPECTRUM:TRACE1?', out=buf)
+    """
+    with session.reserve(inst):
+        inst.write(command)
+        return read_block(inst, datatype, is_big_endian, out, dtype,
+            expect_termination)
@@ -1,6 +1,8 @@
 from __future__ import print_function
 import numpy as np
 import datetime
+from .snapshot import query_many, identity
+from .session import transaction, URGENT
 def prop_doc(var):
     s1 = '{} = property(get_{}, set_{})\n\n'.format(var, var, var)
     s2 = 'See help on get_{} and set_{} functions for info.'.format(var, var)
@@ -103,7 +105,9 @@ class RSsmc100(object):
 
     @freq.setter
     def freq(self, value):
-        self.inst.write('FREQ {} {}'.format(value,self.freq_unit))
+        # Retunes are latency critical, go ahead of queued trace transfers
+        with transaction(self.inst, URGENT):
+            self.inst.write('FREQ {} {}'.format(value,self.freq_unit))
 
     @property
     def phase(self):
@@ -128,15 +132,44 @@ class RSsmc100(object):
         else:
             raise ValueError('rf_on takes 0 for off, 1 for on')
 
+    def snapshot(self, name=None):
+        """
+        snapshot(self, name=None)
+
+        Record the generator settings with a single combined query.
+
+        Args:
+            name (str, optional) : nickname stored with the snapshot
+
+        Returns:
+            dict : timestamp, name, idn, power, pow_unit, freq, freq_unit,
+                phase, phase_unit and rf_on
+        """
+        power, freq, phase, pow_unit, phase_unit, rf_on = query_many(
+            self.inst, ('POW?', 'FREQ?', 'PHASE?', 'UNIT:POW?',
+                        'UNIT:ANGLE?', 'OUTP?'))
+        return {'timestamp': timestamp(),
+                'name': name,
+                'instrument': 'RSsmc100',
+                'idn': identity(self),
+                'power': float(power),
+                'pow_unit': pow_unit,
+                'freq': float(freq)/self.frequencies[self.freq_unit],
+                'freq_unit': self.freq_unit,
+                'phase': float(phase),
+                'phase_unit': phase_unit,
+                'rf_on': int(rf_on)}
+
     def state(self, write_to=None, name=None):
+        snap = self.snapshot(name)
         s = []
-        s.append('{}\n'.format(timestamp()))
+        s.append('{}\n'.format(snap['timestamp']))
         if name is not None:
             s.append('nickname: {}\n'.format(name))
-        s.append('{}'.format(self.inst.query('*IDN?')))
-        s.append('Power: {} {}\n'.format(self.power,self.pow_unit))
-        s.append('Frequency: {} {}\n'.format(self.freq,self.freq_unit))
-        s.append('Phase: {} {}\n'.format(self.phase,self.phase_unit))
+        s.append('{}\n'.format(snap['idn']))
+        s.append('Power: {} {}\n'.format(snap['power'],snap['pow_unit']))
+        s.append('Frequency: {} {}\n'.format(snap['freq'],snap['freq_unit']))
+        s.append('Phase: {} {}\n'.format(snap['phase'],snap['phase_unit']))
         s.append('----------\n')
         if write_to is None:
             for line in s:
@@ -273,7 +306,9 @@ class Hp8647(object):
         """
         if unit is None:
             unit = self.freq_unit
-        self.inst.write('FREQ:CW {} {}'.format(freq,unit))
+        # Retunes are latency critical, go ahead of queued trace transfers
+        with transaction(self.inst, URGENT):
+            self.inst.write('FREQ:CW {} {}'.format(freq,unit))
 
     def get_frequency(self,unit=None):
         """
@@ -363,14 +398,41 @@ class Hp8647(object):
 
     power = property(get_power,set_power, doc=prop_doc('power')) 
 
+    def snapshot(self, name=None):
+        """
+        snapshot(self, name=None)
+
+        Record the generator settings with a single combined query.
+
+        Args:
+            name (str, optional) : nickname stored with the snapshot
+
+        Returns:
+            dict : timestamp, name, idn, power, pow_unit, frequency,
+                freq_unit and rf_on
+        """
+        power, frequency, rf_on = query_many(self.inst,
+            ('POW:AMPL?', 'FREQ:CW?', 'OUTP:STAT?'))
+        return {'timestamp': timestamp(),
+                'name': name,
+                'instrument': 'Hp8647',
+                'idn': identity(self),
+                'power': float(power),
+                'pow_unit': self.pow_unit,
+                'frequency': float(frequency)/self.frequencies[self.freq_unit],
+                'freq_unit': self.freq_unit,
+                'rf_on': int(float(rf_on))}
+
     def state(self, write_to=None, name=None):
+        snap = self.snapshot(name)
         s = []
-        s.append('{}\n'.format(timestamp()))
+        s.append('{}\n'.format(snap['timestamp']))
         if name is not None:
             s.append('nickname: {}\n'.format(name))
-        s.append('{}'.format(self.inst.query('*IDN?')))
-        s.append('Power: {} {}\n'.format(self.power,self.pow_unit))
-        s.append('Frequency: {} {}\n'.format(self.frequency,self.freq_unit))
+        s.append('{}\n'.format(snap['idn']))
+        s.append('Power: {} {}\n'.format(snap['power'],snap['pow_unit']))
+        s.append('Frequency: {} {}\n'.format(snap['frequency'],
+            snap['freq_unit']))
         s.append('----------\n')
         if write_to is None:
             for line in s:
@@ -559,7 +621,9 @@ class Tek3102(object):
             unit = self.freq_unit
         if channel is None:
             channel = self.channel
-        self.inst.write('SOUR{}:FREQ {}{}'.format(channel,freq,unit))
+        # Retunes are latency critical, go ahead of queued trace transfers
+        with transaction(self.inst, URGENT):
+            self.inst.write('SOUR{}:FREQ {}{}'.format(channel,freq,unit))
 
     def get_frequency(self,unit=None,channel=None):
         """
@@ -943,20 +1007,57 @@ class Tek3102(object):
     trigger_source = property(get_trigger_source,set_trigger_source,
         doc=prop_doc('trigger_source'))
 
+    def snapshot(self, name=None):
+        """
+        snapshot(self, name=None)
+
+        Record the settings of the controlled channel with a single combined
+        query.
+
+        Args:
+            name (str, optional) : nickname stored with the snapshot
+
+        Returns:
+            dict : timestamp, name, idn, channel, output, frequency,
+                freq_unit, vmax, vmin, voffset, volt_unit and waveform
+        """
+        ch = self.channel
+        output, frequency, vmax, vmin, voffset, waveform = query_many(
+            self.inst, ('OUTPUT{}?'.format(ch), 'SOUR{}:FREQ?'.format(ch),
+                        'SOUR{}:VOLT:HIGH?'.format(ch),
+                        'SOUR{}:VOLT:LOW?'.format(ch),
+                        'SOUR{}:VOLT:OFFSET?'.format(ch),
+                        'SOUR{}:FUNCTION?'.format(ch)))
+        return {'timestamp': timestamp(),
+                'name': name,
+                'instrument': 'Tek3102',
+                'idn': identity(self),
+                'channel': ch,
+                'output': int(output),
+                'frequency': float(frequency)/self.frequencies[self.freq_unit],
+                'freq_unit': self.freq_unit,
+                'vmax': float(vmax),
+                'vmin': float(vmin),
+                'voffset': float(voffset),
+                'volt_unit': self.volt_unit,
+                'waveform': waveform}
+
     def state(self, write_to=None, name=None):
+        snap = self.snapshot(name)
         s = []
-        s.append('{}\n'.format(timestamp()))
+        s.append('{}\n'.format(snap['timestamp']))
         if name is not None:
             s.append('nickname: {}\n'.format(name))
-        s.append('{}'.format(self.inst.query('*IDN?')))
-        s.append('Channel: {}\n'.format(self.channel))
-        s.append('Output: {}'.format(
-            self.inst.query('OUTPUT{}?'.format(self.channel))))
-        s.append('Frequency: {} {}\n'.format(self.frequency,self.freq_unit))
-        s.append('Vpp: {} {}\n'.format(self.vmax - self.vmin, 
-            self.volt_unit))
-        s.append('DC offset: {} {}\n'.format(self.voffset, self.volt_unit))
-        s.append('Waveform: {}\n'.format(self.waveform))
+        s.append('{}\n'.format(snap['idn']))
+        s.append('Channel: {}\n'.format(snap['channel']))
+        s.append('Output: {}\n'.format(snap['output']))
+        s.append('Frequency: {} {}\n'.format(snap['frequency'],
+            snap['freq_unit']))
+        s.append('Vpp: {} {}\n'.format(snap['vmax'] - snap['vmin'],
+            snap['volt_unit']))
+        s.append('DC offset: {} {}\n'.format(snap['voffset'],
+            snap['volt_unit']))
+        s.append('Waveform: {}\n'.format(snap['waveform']))
         s.append('----------\n')
         if write_to is None:
             for line in s:
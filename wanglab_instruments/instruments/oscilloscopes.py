@@ -1,109 +1,167 @@
+import re
+import time
+import datetime
 import numpy as np
+from .session import transaction, reserve, URGENT, BULK
+from .snapshot import query_many
+from . import binblock
+from .trace import Trace, resolve_dtype, scale
+
+_stamp = re.compile(r'(\d{1,2} \w{3} \d{4} \d{1,2}:\d{2}:\d{2})(\.\d+)?')
+
+def record_window(t_start, t_stop, xzero, xinc):
+    """
+    record_window(t_start, t_stop, xzero, xinc)
+
+    Range of record points (numbered from 1, as in DATa:STARt and DATa:STOP)
+    covering a time window.
+
+    Args:
+        t_start (float) : start of the window
+        t_stop (float) : end of the window
+        xzero (float) : time of the first record point
+        xinc (float) : time between points
+
+    Returns:
+        tuple of int : first and last point
+    """
+    start = max(1, int(np.floor((t_start - xzero)/xinc)) + 1)
+    stop = max(start, int(np.ceil((t_stop - xzero)/xinc)) + 1)
+    return start, stop
+
+def fastframe_times(stamps):
+    """
+    fastframe_times(stamps)
+
+    Frame trigger times from a Tektronix FastFrame time stamp response, e.g.
+    the response to HOR:FAST:TIMES:ALL:CH1? 1,1000, which lists one
+    "02 Mar 2006 17:48:12.123456789012" stamp per frame.
+
+    Args:
+        stamps (str) : time stamp response
+
+    Returns:
+        array : seconds after the first frame, one per frame
+    """
+    seconds = []
+    fractions = []
+    dates = {}
+    for date, fraction in _stamp.findall(stamps):
+        # Many frames share a whole second, parse each second only once
+        if date not in dates:
+            dates[date] = (datetime.datetime.strptime(date,
+                '%d %b %Y %H:%M:%S') - datetime.datetime(1970, 1, 1)
+                ).total_seconds()
+        seconds.append(dates[date])
+        fractions.append(fraction or '0')
+    # Whole seconds and fractions are kept apart until the first frame is
+    # subtracted, so picosecond digits survive the float conversion
+    seconds = np.array(seconds)
+    fractions = np.array(fractions, dtype=float)
+    if len(seconds):
+        seconds -= seconds[0]
+        fractions -= fractions[0]
+    return seconds + fractions
 
 class LecroyWaverunner(object):
     def __init__(self, inst):
         self.inst = inst
         self.inst.write('comm_format def9,word,bin')
-        self.preamble = 21 # bytes in waveform preamble
+        # Responses start directly with the binary block, so the waveform
+        # descriptor begins at byte 0 of the block data
+        self.inst.write('comm_header off')
+        self.preamble = 0 # bytes in waveform preamble
 
     def __repr__(self):
         return 'LecroyWaverunner({!r})'.format(self.inst)
 
-    def cat_bytes(self, byte_sequence):
-        num_bytes = len(byte_sequence)
-        max_val = 2**(8*num_bytes-1) - 1
-        unsigned_int = 0
-        byte_vals = [int(i) for i in byte_sequence]
-        index = 0
-        for i in byte_vals[::-1]:
-            unsigned_int += i*256**index
-            index += 1
-        return unsigned_int
-    
-    def get_float(self, waveform, start_byte):    
-        b0 = format(int(waveform[start_byte]), '#010b')[2::]
-        b1 = format(int(waveform[start_byte + 1]), '#010b')[2::]
-        b2 = format(int(waveform[start_byte + 2]), '#010b')[2::]
-        b3 = format(int(waveform[start_byte + 3]), '#010b')[2::]
-        s = int(b0[0], 2)
-        e = int(b0[1::] + b1[0], 2)
-        f = int(b1[1::] + b2 + b3, 2)
+    def _byte_order(self, waveform):
+        # COMM_ORDER in the descriptor: 0 for big-endian, 1 for little-endian
+        return '<' if waveform[self.preamble + 34] == 1 else '>'
 
-        frac = 1 + f*10**(-1*len(str(f)))
-        exp = 2**(e-127)
+    def _value(self, waveform, byte_location, fmt):
+        # One descriptor field of type fmt ('i4', 'f4', 'f8', ...)
+        dtype = np.dtype(self._byte_order(waveform) + fmt)
+        return np.frombuffer(waveform, dtype=dtype, count=1,
+            offset=self.preamble + byte_location)[0].item()
 
-        return (-1)**s * exp * frac
+    def cat_bytes(self, byte_sequence):
+        return int.from_bytes(bytes(byte_sequence), 'big')
+
+    def get_float(self, waveform, start_byte):
+        return np.frombuffer(waveform, dtype='>f4', count=1,
+            offset=start_byte)[0].item()
 
     def cat_bytes_signed(self, byte_sequence):
-        num_bytes = len(byte_sequence)
-        max_val = 2**(8*num_bytes-1) - 1
-        unsigned_val = 0
-        signed_val = 0
-        byte_vals = [int(i) for i in byte_sequence]
-        index = 0
-        for i in byte_vals[::-1]:
-            unsigned_val += i*256**index
-            index += 1
-        if unsigned_val > max_val:
-            signed_val = unsigned_val - 2**(8*num_bytes)
-        else:
-            signed_val = unsigned_val
-        return signed_val
+        return int.from_bytes(bytes(byte_sequence), 'big', signed=True)
 
     def get_dat_array_length(self, waveform, byte_location=60):
-        byte_location += self.preamble
-        return self.cat_bytes_signed(waveform[byte_location:byte_location+4])
+        return self._value(waveform, byte_location, 'i4')
 
     def get_num_data_points(self, waveform, byte_location=116):
-        byte_location += self.preamble
-        return self.cat_bytes_signed(waveform[byte_location:byte_location+4])
+        return self._value(waveform, byte_location, 'i4')
 
     def get_len_descriptor(self, waveform, byte_location=36):
-        byte_location += self.preamble
-        return self.cat_bytes_signed(waveform[byte_location:byte_location+4])
+        return self._value(waveform, byte_location, 'i4')
 
     def get_vertical_gain(self, waveform, byte_location=156):
-        byte_location += self.preamble
-        return self.get_float(waveform, byte_location)
+        return self._value(waveform, byte_location, 'f4')
 
     def get_vertical_offset(self, waveform, byte_location=160):
-        byte_location += self.preamble
-        return self.get_float(waveform, byte_location)
+        return self._value(waveform, byte_location, 'f4')
 
     def get_horizontal_interval(self, waveform, byte_location=176):
-        byte_location += self.preamble
-        return self.get_float(waveform, byte_location)
+        return self._value(waveform, byte_location, 'f4')
 
     def get_first_valid_point(self, waveform, byte_location=124):
-        byte_location += self.preamble
-        return self.cat_bytes_signed(waveform[byte_location:byte_location+4])
+        return self._value(waveform, byte_location, 'i4')
 
     def get_last_valid_point(self, waveform, byte_location=128):
-        byte_location += self.preamble
-        return self.cat_bytes_signed(waveform[byte_location:byte_location+4])
+        return self._value(waveform, byte_location, 'i4')
+
+    def get_waveform(self, channel, out=None):
+        """
+        get_waveform(self, channel, out=None)
 
-    def get_waveform(self, channel):
-        waveform = self.inst.query('c{}:waveform?'.format(channel))
-        return waveform
+        Raw waveform (descriptor, arrays and data) of a channel as a uint8
+        array.  out is reused if it is large enough.
+        """
+        return binblock.query_block(self.inst,
+            'c{}:waveform?'.format(channel), 'B', out=out)
 
     def format_waveform(self, waveform):
-        len_desc = self.get_len_descriptor(waveform)
+        """
+        format_waveform(self, waveform)
+
+        Time and voltage axes of a waveform returned by get_waveform, as a
+        Trace.  The samples are decoded as one array view of the waveform
+        buffer.
+        """
+        # Data follows the descriptor, user text and time arrays
+        start = sum(self._value(waveform, loc, 'i4') for loc in
+                    (36, 40, 48, 52))
         num_data_points = self.get_num_data_points(waveform)
         dat_array_length = self.get_dat_array_length(waveform)
         data_bytes = int(dat_array_length/num_data_points)
-        wav_array = []
-        for i in range(len_desc+self.preamble, len(waveform), 2):
-            wav_array.append(self.cat_bytes_signed(waveform[i:i+data_bytes]))
+        dtype = np.dtype(self._byte_order(waveform) + 'i{}'.format(data_bytes))
+        raw = np.frombuffer(waveform, dtype=dtype, count=num_data_points,
+            offset=self.preamble + start)
         vert_gain = self.get_vertical_gain(waveform)
         vert_off = self.get_vertical_offset(waveform)
         hor_int = self.get_horizontal_interval(waveform)
 
-        t = np.linspace(0,len(wavarray)*hor_int, len(wav_array))
-        y = np.array(wav_array)*vert_gain - vert_off
+        y = scale(raw, vert_gain, zero=-vert_off,
+                  dtype=resolve_dtype(None, self))
 
-        return t, y
+        return Trace(y, 0., stop=len(raw)*hor_int, x_unit='s', y_unit='V')
 
-        
+    def fetch_spectrum(self, channel):
+        """
+        fetch_spectrum(self, channel)
+
+        Return the time and voltage axes of a channel.
+        """
+        return self.format_waveform(self.get_waveform(channel))
 
 class Tek7104(object):
     """Initialize Tek7104 class object
@@ -129,9 +187,56 @@ class Tek7104(object):
     def __repr__(self):
         return 'Tek7104({!r})'.format(self.inst)
 
-    def fetch_spectrum(self,trace,offset=False):
+    def _curve(self, trace, out=None, frames=None, start=1, stop=250000,
+            width=2):
+        # Preamble fields and raw samples (width bytes each) of a channel.
+        # The scope is reserved so the source and encoding can't change while
+        # the data is read, but the bus is only held for the setup; the curve
+        # is read in chunks with the bus released in between.
+        with reserve(self.inst):
+            with transaction(self.inst, BULK):
+                self.inst.write('*CLS')
+                self.inst.write('DAT:ENCDG RIBINARY')
+                self.inst.write('WFMO:BYT_NR {}'.format(width))
+                self.inst.write('WFMO:BYT_OR MSB')
+                self.inst.write('DAT:SOU CH{}'.format(trace))
+                self.inst.write('DAT:STAR {}'.format(start))
+                self.inst.write('DAT:STOP {}'.format(stop))
+                if frames is not None:
+                    self.inst.write('DAT:FRAMESTAR 1')
+                    self.inst.write('DAT:FRAMESTOP {}'.format(frames))
+                #WFMO? has the relevant list parameters:
+                #[6]: POINTS, [8]: XUNIT, [9]:XUNIT/PT,[10]: XZERO,
+                #[12]:YUNIT, [13]:YMULT,[14]:YOFFSET
+                #XZERO is the time of the first point transferred
+                result=self.inst.query('WFMO?').split(';')
+            #CURV? is the raw data from the scope, big-endian integers.
+            #With FastFrame on it holds all frames back to back.
+            raw=binblock.query_block(self.inst,'CURV?',
+                'h' if width == 2 else 'b',True,out=out)
+        return result, raw
+
+    def _scale(self, result, raw, offset, stride=1):
+        # Only the points that are kept are scaled
+        raw=raw[...,::stride]
+        y=scale(raw,float(result[13]),0. if offset else float(result[14]),
+                dtype=resolve_dtype(None,self))
+        return Trace(y,float(result[10]),stride*float(result[9]),
+                     x_unit=result[8].strip('"'),y_unit=result[12].strip('"'))
+
+    def _timebase(self, trace):
+        # Time of the first record point and time between points
+        with transaction(self.inst):
+            self.inst.write('DAT:SOU CH{}'.format(trace))
+            self.inst.write('DAT:STAR 1')
+            xzero, xinc = query_many(self.inst, (':WFMO:XZE?', ':WFMO:XIN?'))
+        return float(xzero), float(xinc)
+
+    def fetch_spectrum(self,trace,offset=False,out=None,start=1,stop=250000,
+            stride=1):
         """
-        fetch_spectrum(self, trace, offset=False)
+        fetch_spectrum(self, trace, offset=False, out=None, start=1,
+            stop=250000, stride=1)
 
         Return the x and y axes data from a channel (trace).
 
@@ -139,27 +244,146 @@ class Tek7104(object):
             trace (int) : channel to retrieve
             offset (bool) : if True, the y axis is offset from 0V according to
                 the offset set on the scope for viewing multiple waveforms
+            out (array, optional) : int16 array to receive the raw samples,
+                reused if it is large enough
+            start (int, optional) : first record point to transfer, from 1
+            stop (int, optional) : last record point to transfer
+            stride (int, optional) : keep every stride-th point transferred
 
         Returns:
-            tuple : numpy array of time axis, numpy array of volt axis
+            Trace : volts against time, unpacks as x, y
         """
-        self.inst.write('*CLS')
-        self.inst.write('DAT:ENCDG ASCII')
-        self.inst.write('DAT:SOU CH{}'.format(trace))
-        self.inst.write('DAT:STOP 250000')
-        self.inst.write('WAVF?')
-        #WAVF? returns the results of CURV? and WFMO?.  WFMO? has the 
-        #relevant list parameters:
-        #[6]: POINTS, [8]: XUNIT, [9]:XUNIT/PT,[10]: XZERO,[12]:YUNIT,
-        #[13]:YMULT,[14]:YOFFSET
-        #[17] is the result of the CURV? command, which is the raw data from 
-        #the scope with encoding DAT:ENCDG
-        result=self.inst.read().split(';')
-        x=[(float(i)+float(result[10]))*float(result[9]) for i in range(int(result[6]))]
-        y=[(float(val)-float(result[14]))*float(result[13]) for val in result[17].split(',')]
-        if offset:
-            y=[float(val)*float(result[13]) for val in result[17].split(',')]
-        return np.array(x),np.array(y) #x,y
+        result, raw = self._curve(trace, out, start=start, stop=stop)
+        return self._scale(result, raw, offset, stride)
+
+    def fetch_preview(self, trace, stride=100, offset=False):
+        """
+        fetch_preview(self, trace, stride=100, offset=False)
+
+        Coarse view of a whole record for finding the region of interest,
+        to be followed by fetch_window.  The record is transferred at 8 bits
+        per point, half the bytes of fetch_spectrum, and every stride-th point
+        is kept.
+
+        Returns:
+            Trace : volts against time, unpacks as x, y
+        """
+        result, raw = self._curve(trace, width=1)
+        return self._scale(result, raw, offset, stride)
+
+    def fetch_window(self, trace, t_start, t_stop, offset=False, out=None):
+        """
+        fetch_window(self, trace, t_start, t_stop, offset=False, out=None)
+
+        Full resolution data of the part of the record between two times,
+        e.g. a few hundred points around the trigger.  Only that part is
+        transferred.
+
+        Args:
+            trace (int) : channel to retrieve
+            t_start (float) : start time in seconds, on the scale of the x
+                axis returned by fetch_spectrum
+            t_stop (float) : stop time in seconds
+            offset (bool) : see fetch_spectrum
+            out (array, optional) : see fetch_spectrum
+
+        Returns:
+            Trace : volts against time, unpacks as x, y
+        """
+        with reserve(self.inst):
+            start, stop = record_window(t_start, t_stop,
+                                        *self._timebase(trace))
+            return self.fetch_spectrum(trace, offset, out, start, stop)
+
+#############################FastFrame################################
+
+    def arm_frames(self, frames):
+        """
+        arm_frames(self, frames)
+
+        Start a FastFrame (segmented) acquisition of a number of triggers.
+        The scope stores every trigger as a frame and stops when all frames
+        are acquired, see wait_frames.
+
+        Args:
+            frames (int) : number of frames to acquire
+        """
+        with transaction(self.inst, URGENT):
+            self.inst.write('HOR:FAST:STATE ON')
+            self.inst.write('HOR:FAST:COUN {}'.format(int(frames)))
+            self.inst.write('ACQ:STOPA SEQ')
+            self.inst.write('ACQ:STATE RUN')
+
+    def wait_frames(self, timeout=60., poll=0.05):
+        """
+        wait_frames(self, timeout=60., poll=0.05)
+
+        Wait until the acquisition started by arm_frames is complete.  The
+        scope is polled, so the bus is free for other instruments in between.
+
+        Args:
+            timeout (float, optional) : seconds to wait before raising
+                RuntimeError
+            poll (float, optional) : seconds between polls
+        """
+        end = time.time() + timeout
+        while int(self.inst.query('ACQ:STATE?')):
+            if time.time() > end:
+                raise RuntimeError('FastFrame acquisition not complete after '
+                                   '{} s'.format(timeout))
+            time.sleep(poll)
+
+    def fetch_frames(self, trace, offset=False, out=None):
+        """
+        fetch_frames(self, trace, offset=False, out=None)
+
+        Transfer every frame of a FastFrame acquisition in one binary block.
+
+        Args:
+            trace (int) : channel to retrieve
+            offset (bool) : if True, the y axis is offset from 0V according to
+                the offset set on the scope for viewing multiple waveforms
+            out (array, optional) : int16 array to receive the raw samples of
+                all frames, reused if it is large enough
+
+        Returns:
+            tuple : numpy array of time axis within a frame, 2D numpy array
+                of volts with one row per frame, numpy array of frame trigger
+                times in seconds after the first frame
+        """
+        # The scope is reserved throughout, but the bus is only held per
+        # command and per chunk of the frame stack
+        with reserve(self.inst):
+            frames = int(self.inst.query('HOR:FAST:COUN?'))
+            result, raw = self._curve(trace, out, frames)
+            stamps = self.inst.query('HOR:FAST:TIMES:ALL:CH{}? 1,{}'.format(
+                trace, frames))
+        frame = self._scale(result, raw.reshape(frames, -1), offset)
+        return frame.x, frame.y, fastframe_times(stamps)
+
+    def acquire_frames(self, trace, frames, offset=False, timeout=60.,
+            out=None):
+        """
+        acquire_frames(self, trace, frames, offset=False, timeout=60.,
+            out=None)
+
+        Acquire a number of triggers with FastFrame and transfer them, see
+        arm_frames, wait_frames and fetch_frames.
+
+        Returns:
+            tuple : time axis, 2D volts (frames x points), frame times
+
+        Examples:
+            >>> t, shots, times = scope.acquire_frames(1, 1000)
+            >>> mean_shot = shots.mean(axis=0)
+        """
+        self.arm_frames(frames)
+        self.wait_frames(timeout)
+        return self.fetch_frames(trace, offset, out)
+
+    def fastframe_off(self):
+        """Return to acquiring one waveform per trigger."""
+        self.inst.write('HOR:FAST:STATE OFF')
 
 class RigolDS2102(object):
 
@@ -170,13 +394,120 @@ class RigolDS2102(object):
         return 'RigolDS2102({!r})'.format(self.inst)
 
     def fetch_spectrum(self, trace = 1):
-        self.inst.write(':WAV:SOURce CHAN{}'.format(trace))
-        self.inst.write(':WAV:FORMAT ASCII')
-        x_inc = float(self.inst.query(':WAV:XINC?'))
-        x_0 = float(self.inst.query(':WAV:XREF?'))
-        y = self.inst.query_ascii_values(':WAV:DATA?')
-        x = np.linspace(x_0, x_0 + x_inc*len(y), len(y))
-        return x, np.array(y)
+        # The source and format must not change while the data is read
+        with transaction(self.inst, BULK):
+            self.inst.write(':WAV:SOURce CHAN{}'.format(trace))
+            self.inst.write(':WAV:MODE NORM')
+            self.inst.write(':WAV:FORMAT ASCII')
+            x_inc = float(self.inst.query(':WAV:XINC?'))
+            x_0 = float(self.inst.query(':WAV:XREF?'))
+            y = self.inst.query_ascii_values(':WAV:DATA?')
+        return Trace(y, x_0, stop=x_0 + x_inc*len(y), x_unit='s', y_unit='V',
+                     dtype=resolve_dtype(None, self))
+
+    # Most points :WAV:DATA? returns at once in RAW mode, by bytes per point
+    max_points = {1: 250000, 2: 125000}
+    # Points of the screen waveform read in NORM mode
+    screen_points = 1400
+
+    def fetch_memory(self, trace=1, points=None, width=1, chunk=None,
+            out=None):
+        """
+        fetch_memory(self, trace=1, points=None, width=1, chunk=None,
+            out=None)
+
+        Read the full acquisition memory of a channel in binary.  The scope is
+        stopped (RAW mode needs it), the memory is read in chunks selected with
+        :WAV:STAR and :WAV:STOP straight into one preallocated array, and the
+        preamble scaling is applied in a single vectorized step.  Between
+        chunks the bus is free for other instruments.  Afterwards NORM mode
+        and the full screen range are selected again, for fetch_spectrum.
+        The scope is left stopped; send ':RUN' to resume.
+
+        Args:
+            trace (int, optional) : channel to retrieve
+            points (int, optional) : number of points to read from the start
+                of memory.  Default is the whole memory.
+            width (int, optional) : bytes per point, 1 (BYTE) or 2 (WORD)
+            chunk (int, optional) : points per :WAV:DATA? query.  Default is
+                the largest the scope allows.
+            out (array, optional) : uint8 (width 1) or uint16 (width 2) array
+                to receive the raw samples, reused if it is large enough
+
+        Returns:
+            Trace : volts against time, unpacks as x, y
+        """
+        if width not in self.max_points:
+            raise ValueError('width = { 1 | 2 }')
+        datatype = 'B' if width == 1 else 'H'
+        if chunk is None:
+            chunk = self.max_points[width]
+        with reserve(self.inst):
+            with transaction(self.inst, URGENT):
+                self.inst.write(':STOP')
+                self.inst.write(':WAV:SOURce CHAN{}'.format(trace))
+                self.inst.write(':WAV:MODE RAW')
+                self.inst.write(':WAV:FORMAT {}'.format(
+                    'BYTE' if width == 1 else 'WORD'))
+                # format,type,points,count,xinc,xorigin,xref,yinc,yorigin,yref
+                pre = [float(v) for v in
+                       self.inst.query(':WAV:PRE?').split(',')]
+            n = int(pre[2]) if points is None else min(int(points),
+                                                       int(pre[2]))
+            if out is None or len(out) < n:
+                out = np.empty(n, dtype=datatype)
+            raw = out[:n]
+            try:
+                for start in range(0, n, chunk):
+                    stop = min(start + chunk, n)
+                    with transaction(self.inst, BULK):
+                        self.inst.write(':WAV:STAR {}'.format(start + 1))
+                        self.inst.write(':WAV:STOP {}'.format(stop))
+                        got = binblock.query_block(self.inst, ':WAV:DATA?',
+                            datatype, out=raw[start:stop])
+                    if len(got) != stop - start:
+                        raise ValueError('Expected {} points from '
+                            ':WAV:DATA?, got {}'.format(stop - start,
+                                                         len(got)))
+            finally:
+                with transaction(self.inst, URGENT):
+                    self.inst.write(':WAV:MODE NORM')
+                    self.inst.write(':WAV:STAR 1')
+                    self.inst.write(':WAV:STOP {}'.format(
+                        self.screen_points))
+        xinc, xorigin, xref, yinc, yorigin, yref = pre[4:10]
+        y = scale(raw, yinc, yorigin + yref, dtype=resolve_dtype(None, self))
+        return Trace(y, xorigin - xref*xinc, xinc, x_unit='s', y_unit='V')
+
+    def fetch_channels(self, traces=(1, 2)):
+        """
+        fetch_channels(self, traces=(1, 2))
+
+        Return the data of several channels, transferred back to back after
+        setting the format and reading the time base once.
+
+        Args:
+            traces (sequence of int, optional) : channels to retrieve
+
+        Returns:
+            Trace : 2D volts with one row per channel, against the time axis
+                shared by all channels.  Unpacks as x, y.
+        """
+        with transaction(self.inst, BULK):
+            self.inst.write(':WAV:MODE NORM')
+            self.inst.write(':WAV:FORMAT ASCII')
+            x_inc = float(self.inst.query(':WAV:XINC?'))
+            x_0 = float(self.inst.query(':WAV:XREF?'))
+            y = None
+            for i, trace in enumerate(traces):
+                self.inst.write(':WAV:SOURce CHAN{}'.format(trace))
+                data = self.inst.query_ascii_values(':WAV:DATA?')
+                if y is None:
+                    y = np.empty((len(traces), len(data)),
+                                 dtype=resolve_dtype(None, self))
+                y[i] = data
+        n = y.shape[1]
+        return Trace(y, x_0, stop=x_0 + x_inc*n, x_unit='s', y_unit='V')
     
 
 class Tek3034(object):
@@ -204,9 +535,43 @@ class Tek3034(object):
     def __repr__(self):
         return 'Tek3034({!r})'.format(self.inst)
 
-    def fetch_spectrum(self, trace, offset=False):
+    def _configure(self, start=1, stop=10000, width=2):
+        self.inst.write('*CLS')
+        self.inst.write('DAT:ENCDG RIBINARY')
+        self.inst.write('WFMP:BYT_NR {}'.format(width))
+        self.inst.write('WFMP:BYT_OR MSB')
+        self.inst.write('DAT:STARt {}'.format(start))
+        self.inst.write('DAT:STOP {}'.format(stop))
+
+    def _channel(self, trace, out=None, width=2):
+        # Raw samples and vertical scaling (ymult, yoff, yzero) of a channel.
+        # Only the source selection and preamble hold the bus, the curve is
+        # read in chunks with the bus released in between.  Callers reserve
+        # the scope so the settings can't change before the curve is read.
+        with transaction(self.inst, BULK):
+            self.inst.write('DAT:SOU CH{}'.format(trace))
+            scale=[float(v) for v in query_many(self.inst,
+                (':WFMP:YMULT?', ':WFMP:YOFF?', ':WFMP:YZERO?'))]
+        raw=binblock.query_block(self.inst,'CURV?',
+            'h' if width == 2 else 'b',True,out=out)
+        return raw, scale
+
+    def _timebase(self):
+        # Time of the first record point and time between points
+        xzero, xinc = query_many(self.inst, (':WFMP:XZERO?', ':WFMP:XINC?'))
+        return float(xzero), float(xinc)
+
+    def _time_axis(self, start, stride):
+        # First time and step of the points kept.  XZERO refers to the start
+        # of the record, not the first point sent.
+        xzero, xinc = self._timebase()
+        return xzero + (start - 1)*xinc, stride*xinc
+
+    def fetch_spectrum(self, trace, offset=False, out=None, start=1,
+            stop=10000, stride=1):
         """
-        fetch_spectrum(self, trace, offset=False)
+        fetch_spectrum(self, trace, offset=False, out=None, start=1,
+            stop=10000, stride=1)
 
         Return the x and y axes data from a channel (trace).
 
@@ -214,26 +579,112 @@ class Tek3034(object):
             trace (int) : channel to retrieve
             offset (bool) : if True, the y axis is offset from 0V according to
                 the offset set on the scope for viewing multiple waveforms
+            out (array, optional) : int16 array to receive the raw samples,
+                reused if it is large enough
+            start (int, optional) : first record point to transfer, from 1
+            stop (int, optional) : last record point to transfer
+            stride (int, optional) : keep every stride-th point transferred
 
         Returns:
-            tuple : numpy array of time axis, numpy array of volt axis
+            Trace : volts against time, unpacks as x, y
         """
 
-        self.inst.write('*CLS')
-        self.inst.write('DAT:ENCDG ASCII')
-        self.inst.write('DAT:SOU CH{}'.format(trace))
-        self.inst.write('DAT:SART 1')
-        self.inst.write('DAT:STOP 10000')
-        raw=np.array(self.inst.query_ascii_values('CURV?'))
-        ymult=float(self.inst.query('WFMP:YMULT?'))
-        yoff=float(self.inst.query('WFMP:YOFF?'))
-        yzero=float(self.inst.query('WFMP:YZERO?'))
-        if offset is True:
-            y=(raw)*ymult + yzero
-        else:
-            y=(raw-yoff)*ymult + yzero
-        xinc=float(self.inst.query('WFMP:XINC?'))
-        xzero=float(self.inst.query('WFMP:XZERO?'))
-        pts=int(self.inst.query('WFMP:NR_PT?'))
-        x=np.linspace(xzero,xzero+pts*xinc,pts)
-        return x,y
+        # The source must not change while the data and preamble are read
+        with reserve(self.inst):
+            with transaction(self.inst, BULK):
+                self._configure(start, stop)
+            raw, (ymult, yoff, yzero) = self._channel(trace, out)
+            raw=raw[::stride]
+            x0, dx=self._time_axis(start, stride)
+        y=scale(raw, ymult, 0. if offset is True else yoff, yzero,
+                resolve_dtype(None, self))
+        return Trace(y, x0, dx, x_unit='s', y_unit='V')
+
+    def fetch_preview(self, trace, stride=10, offset=False):
+        """
+        fetch_preview(self, trace, stride=10, offset=False)
+
+        Coarse view of a whole record for finding the region of interest,
+        to be followed by fetch_window.  The record is transferred at 8 bits
+        per point, half the bytes of fetch_spectrum, and every stride-th point
+        is kept.
+
+        Returns:
+            Trace : volts against time, unpacks as x, y
+        """
+        with reserve(self.inst):
+            with transaction(self.inst, BULK):
+                self._configure(width=1)
+            raw, (ymult, yoff, yzero) = self._channel(trace, width=1)
+            raw=raw[::stride]
+            x0, dx=self._time_axis(1, stride)
+        y=scale(raw, ymult, 0. if offset is True else yoff, yzero,
+                resolve_dtype(None, self))
+        return Trace(y, x0, dx, x_unit='s', y_unit='V')
+
+    def fetch_window(self, trace, t_start, t_stop, offset=False, out=None):
+        """
+        fetch_window(self, trace, t_start, t_stop, offset=False, out=None)
+
+        Full resolution data of the part of the record between two times,
+        e.g. a few hundred points around the trigger.  Only that part is
+        transferred.
+
+        Args:
+            trace (int) : channel to retrieve
+            t_start (float) : start time in seconds, on the scale of the x
+                axis returned by fetch_spectrum
+            t_stop (float) : stop time in seconds
+            offset (bool) : see fetch_spectrum
+            out (array, optional) : see fetch_spectrum
+
+        Returns:
+            Trace : volts against time, unpacks as x, y
+        """
+        start, stop = record_window(t_start, t_stop, *self._timebase())
+        return self.fetch_spectrum(trace, offset, out, start, min(stop, 10000))
+
+    def fetch_channels(self, traces=(1, 2, 3, 4), offset=False, start=1,
+            stop=10000, stride=1):
+        """
+        fetch_channels(self, traces=(1, 2, 3, 4), offset=False, start=1,
+            stop=10000, stride=1)
+
+        Return the data of several channels, transferred back to back after
+        configuring the transfer once.
+
+        Args:
+            traces (sequence of int, optional) : channels to retrieve
+            offset (bool) : if True, the y axes are offset from 0V according
+                to the offsets set on the scope for viewing multiple waveforms
+            start, stop, stride (int, optional) : see fetch_spectrum
+
+        Returns:
+            Trace : 2D volts with one row per channel, against the time axis
+                shared by all channels.  Unpacks as x, y.
+        """
+        y = None
+        raw = None
+        # The scope is reserved for all channels, but the bus is only held
+        # for the setup and each channel's preamble, see _channel
+        with reserve(self.inst):
+            with transaction(self.inst, BULK):
+                self._configure(start, stop)
+            for i, trace in enumerate(traces):
+                # The int16 buffer of the first channel is reused
+                raw, (ymult, yoff, yzero) = self._channel(trace, raw)
+                kept = raw[::stride]
+                if y is None:
+                    y = np.empty((len(traces), len(kept)),
+                                 dtype=resolve_dtype(None, self))
+                elif len(kept) != y.shape[1]:
+                    raise ValueError('CH{} has {} points, expected {}'.format(
+                        trace, len(kept), y.shape[1]))
+                if offset is True:
+                    np.multiply(kept, ymult, out=y[i])
+                else:
+                    np.subtract(kept, yoff, out=y[i])
+                    y[i] *= ymult
+                y[i] += yzero
+            x0, dx = self._time_axis(start, stride)
+        return Trace(y, x0, dx, x_unit='s', y_unit='V')
@@ -0,0 +1,426 @@
+import threading
+import heapq
+import itertools
+
+###################### Shared-bus sessions ###############################
+#
+# Several instruments often share one GPIB controller.  A Session owns the
+# communication resources and gives every bus a scheduler, so a query (write
+# then read) from one thread can't be split by a command from another.
+# Drivers are created with the LockedResource returned by Session.open instead
+# of the raw pyVisa Resource, and need no other changes.  Instruments on
+# different buses (another GPIB controller, LAN, serial) have different
+# schedulers and run in parallel.
+#
+# Commands waiting for a bus are served by priority, then in arrival order.
+# Latency-critical operations (trigger arming, generator retunes) run at
+# URGENT priority, ordinary commands at NORMAL, and bulk trace transfers at
+# BULK priority.  Large binary blocks are read in chunks with the bus released
+# between chunks, so a long transfer doesn't hold up the other instruments.
+
+URGENT = 0
+NORMAL = 1
+BULK = 2
+
+# Bytes read per bus acquisition by read_chunked
+CHUNK_SIZE = 65536
+
+def bus_of(resource_name):
+    """
+    bus_of(resource_name)
+
+    Name of the bus a VISA resource is on.  Instruments on the same bus share
+    a lock.  All GPIB instruments on one board share that board
+    ('GPIB0::5::INSTR' -> 'GPIB0'), every other interface (LAN, serial, USB)
+    is treated as its own bus.
+
+    Args:
+        resource_name (str) : VISA resource name
+
+    Returns:
+        str : bus name
+    """
+    board = resource_name.split('::')[0]
+    if board.upper().startswith('GPIB'):
+        return board.upper()
+    return resource_name
+
+class BusScheduler(object):
+    """
+    Initialize BusScheduler class object
+
+    Reentrant lock of one bus that hands the bus to waiting threads by
+    priority (lowest number first), and in arrival order within a priority.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._owner = None
+        self._count = 0
+        self._waiting = []
+        self._arrival = itertools.count()
+
+    def __repr__(self):
+        return 'BusScheduler(owner={!r}, waiting={})'.format(self._owner,
+            len(self._waiting))
+
+    def acquire(self, priority=NORMAL):
+        """
+        acquire(self, priority=NORMAL)
+
+        Wait for the bus.  A thread that already holds the bus gets it again
+        immediately.
+
+        Args:
+            priority (int, optional) : { URGENT | NORMAL | BULK }
+        """
+        me = threading.current_thread()
+        with self._cond:
+            if self._owner is me:
+                self._count += 1
+                return True
+            entry = (priority, next(self._arrival), me)
+            heapq.heappush(self._waiting, entry)
+            try:
+                while (self._owner is not None
+                       or self._waiting[0] is not entry):
+                    self._cond.wait()
+            except BaseException:
+                # e.g. KeyboardInterrupt.  A stale entry at the top of the
+                # heap would block every other thread for good.
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._owner = me
+            self._count = 1
+            return True
+
+    def release(self):
+        """Release the bus, handing it to the next waiting thread."""
+        with self._cond:
+            if self._owner is not threading.current_thread():
+                raise RuntimeError('release of a bus not held by this thread')
+            self._count -= 1
+            if self._count == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+class _Hold(object):
+    # Holds the device lock of a LockedResource and its bus at a priority
+    def __init__(self, locked, priority):
+        self.locked = locked
+        self.priority = priority
+
+    def __enter__(self):
+        self.locked.device_lock.acquire()
+        try:
+            self.locked.lock.acquire(self.priority)
+        except BaseException:
+            self.locked.device_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self.locked.lock.release()
+        self.locked.device_lock.release()
+        return False
+
+class _Unlocked(object):
+    # Stand-in for a lock when the resource is not managed by a Session
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def transaction(inst, priority=None):
+    """
+    transaction(inst, priority=None)
+
+    Context manager holding the bus of inst for a sequence of commands that
+    must not be interleaved with other commands, e.g. a write followed by a
+    read.  Does nothing if inst is not a LockedResource, so drivers can use it
+    unconditionally.
+
+    Args:
+        inst (object) : communication object of a driver
+        priority (int, optional) : { URGENT | NORMAL | BULK }.  Defaults to
+            the priority of the resource.
+
+    Examples:
+        >>> with transaction(self.inst, BULK):
+        ...     self.inst.write('WAVF?')
+        ...     result = self.inst.read()
+    """
+    if not isinstance(inst, LockedResource):
+        return _Unlocked()
+    return inst.transaction(priority)
+
+def reserve(inst):
+    """
+    reserve(inst)
+
+    Context manager reserving the instrument behind inst, but not its bus,
+    for a sequence of transactions, e.g. a query whose response is read in
+    several chunks.  Does nothing if inst is not a LockedResource.
+
+    Args:
+        inst (object) : communication object of a driver
+    """
+    if not isinstance(inst, LockedResource):
+        return _Unlocked()
+    return inst.device_lock
+
+def read_chunked(inst, nbytes, chunk_size=None, out=None):
+    """
+    read_chunked(inst, nbytes, chunk_size=None, out=None)
+
+    Read exactly nbytes from inst.  For a LockedResource the bytes are read in
+    chunks at BULK priority, and the bus is released between chunks so
+    commands for other instruments can run.  The instrument itself stays
+    reserved for the whole read.
+
+    Args:
+        inst (object) : communication object with a read_bytes method
+        nbytes (int) : number of bytes to read
+        chunk_size (int, optional) : bytes per chunk.  Default CHUNK_SIZE.
+        out (writable buffer, optional) : buffer of nbytes bytes to fill, e.g.
+            a numpy array
+
+    Returns:
+        bytearray : the data, or out if given
+    """
+    if out is None:
+        out = bytearray(nbytes)
+    view = memoryview(out).cast('B')
+    if not isinstance(inst, LockedResource):
+        view[:nbytes] = inst.read_bytes(nbytes)
+        return out
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    # Transports that can receive into a buffer skip the copy
+    read_into = getattr(inst.resource, 'read_into', None)
+    with inst.device_lock:
+        pos = 0
+        while pos < nbytes:
+            n = min(chunk_size, nbytes - pos)
+            inst.lock.acquire(BULK)
+            try:
+                if read_into is not None:
+                    read_into(view[pos:pos + n])
+                else:
+                    view[pos:pos + n] = inst.resource.read_bytes(n)
+            finally:
+                inst.lock.release()
+            pos += n
+    return out
+
+def query_binary_values(inst, command, datatype='f', is_big_endian=False,
+        out=None):
+    """
+    query_binary_values(inst, command, datatype='f', is_big_endian=False,
+        out=None)
+
+    Query an IEEE 488.2 binary block.  For a LockedResource the block is read
+    with read_chunked, so a large trace doesn't hold the bus for the whole
+    transfer.  See binblock.query_block.
+
+    Args:
+        inst (object) : communication object
+        command (str) : query returning a binary block
+        datatype (str, optional) : struct format character of the values.
+            Default 'f' (float32).
+        is_big_endian (bool, optional) : byte order of the values
+        out (array, optional) : array to receive the values, reused if it is
+            large enough
+
+    Returns:
+        array : the values
+    """
+    from .binblock import query_block
+    return query_block(inst, command, datatype, is_big_endian, out)
+
+class LockedResource(object):
+    """
+    Initialize LockedResource class object
+
+    Wraps a communication resource so every call holds the lock of its bus.
+    Methods that are not wrapped, and attributes such as timeout, are passed
+    through to the resource.
+
+    Args:
+        resource (object) : communication object, typically a pyVisa Resource
+        lock (BusScheduler) : scheduler of the bus the resource is on
+        bus (str) : name of the bus
+        priority (int, optional) : { URGENT | NORMAL | BULK } default
+            priority of commands to this resource.  Default NORMAL.
+    """
+
+    _locked_methods = ('write', 'read', 'query', 'write_raw', 'read_raw',
+                       'read_bytes', 'query_ascii_values',
+                       'query_binary_values', 'write_binary_values',
+                       'write_ascii_values', 'read_stb', 'assert_trigger',
+                       'wait_for_srq', 'clear')
+
+    def __init__(self, resource, lock, bus, priority=NORMAL):
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, 'lock', lock)
+        object.__setattr__(self, 'bus', bus)
+        object.__setattr__(self, 'priority', priority)
+        # Reserves the instrument itself, e.g. during a chunked read
+        object.__setattr__(self, 'device_lock', threading.RLock())
+
+    def __repr__(self):
+        return 'LockedResource({!r}, bus={!r})'.format(self.resource, self.bus)
+
+    def transaction(self, priority=None):
+        """Hold the bus for several calls, see session.transaction."""
+        if priority is None:
+            priority = self.priority
+        return _Hold(self, priority)
+
+    def __getattr__(self, name):
+        attr = getattr(self.resource, name)
+        if name in self._locked_methods and callable(attr):
+            hold = self.transaction
+            def locked(*args, **kwargs):
+                with hold():
+                    return attr(*args, **kwargs)
+            locked.__name__ = name
+            locked.__doc__ = attr.__doc__
+            return locked
+        return attr
+
+    def __setattr__(self, name, value):
+        if name == 'priority':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.resource, name, value)
+
+class Session(object):
+    """
+    Initialize Session class object
+
+    Owns the communication resources of an experiment and the schedulers of
+    the buses they are on.
+
+    Args:
+        resource_manager (object, optional) : pyVisa ResourceManager used by
+            open.  Created on first use if not given.
+
+    Examples:
+        >>> import wanglab_instruments as wl
+        >>> with wl.instruments.session.Session() as session:
+        ...     rsa = wl.spectrum_analyzers.Tek5103(
+        ...         session.open('GPIB0::1::INSTR'))
+        ...     scope = wl.oscilloscopes.Tek7104(
+        ...         session.open('GPIB0::2::INSTR'))
+        ...     hp = wl.function_generators.Hp8647(
+        ...         session.open('GPIB0::5::INSTR', priority=URGENT))
+        ...     # rsa, scope and hp may now be used from different threads,
+        ...     # and hp retunes go ahead of queued trace transfers
+    """
+
+    def __init__(self, resource_manager=None):
+        self.resource_manager = resource_manager
+        self.resources = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def __repr__(self):
+        return 'Session({!r})'.format(sorted(self.resources))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def lock(self, bus):
+        """
+        lock(self, bus)
+
+        The scheduler of a bus, created on first use.
+
+        Args:
+            bus (str) : bus name, see bus_of
+
+        Returns:
+            BusScheduler : scheduler of the bus
+        """
+        with self._locks_lock:
+            if bus not in self._locks:
+                self._locks[bus] = BusScheduler()
+            return self._locks[bus]
+
+    def add(self, resource, name, bus=None, priority=NORMAL):
+        """
+        add(self, resource, name, bus=None, priority=NORMAL)
+
+        Manage a resource that is already open, e.g. a transport that is not
+        a VISA resource.
+
+        Args:
+            resource (object) : communication object
+            name (str) : name to store the resource under
+            bus (str, optional) : bus the resource is on.  Defaults to
+                bus_of(name).
+            priority (int, optional) : { URGENT | NORMAL | BULK } default
+                priority of the resource's commands
+
+        Returns:
+            LockedResource : the wrapped resource, to pass to a driver
+        """
+        if bus is None:
+            bus = bus_of(name)
+        locked = LockedResource(resource, self.lock(bus), bus, priority)
+        self.resources[name] = locked
+        return locked
+
+    def open(self, resource_name, priority=NORMAL, **kwargs):
+        """
+        open(self, resource_name, priority=NORMAL, **kwargs)
+
+        Open a VISA resource.  Opening the same resource twice returns the
+        same LockedResource.
+
+        Args:
+            resource_name (str) : VISA resource name, e.g. 'GPIB0::1::INSTR'
+            priority (int, optional) : { URGENT | NORMAL | BULK } default
+                priority of the resource's commands
+            **kwargs : passed to ResourceManager.open_resource
+
+        Returns:
+            LockedResource : the wrapped resource, to pass to a driver
+        """
+        if resource_name in self.resources:
+            return self.resources[resource_name]
+        if self.resource_manager is None:
+            try:
+                import pyvisa as visa
+            except ImportError:
+                import visa
+            self.resource_manager = visa.ResourceManager()
+        resource = self.resource_manager.open_resource(resource_name,
+            **kwargs)
+        return self.add(resource, resource_name, priority=priority)
+
+    def close(self):
+        """Close every resource of the session."""
+        for name, locked in list(self.resources.items()):
+            with locked.transaction():
+                close = getattr(locked.resource, 'close', None)
+                if close is not None:
+                    close()
+            del self.resources[name]
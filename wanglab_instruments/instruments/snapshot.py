@@ -0,0 +1,97 @@
+import json
+
+###################### Instrument state snapshots ###############################
+#
+# A snapshot is a flat dict of an instrument's settings, built by the
+# snapshot() method of a driver.  Snapshots are plain JSON types so they can
+# be stored one per line next to the measurement data, and compared with
+# diff_snapshots to log only what changed.
+
+def query_many(inst, queries):
+    """
+    query_many(inst, queries)
+
+    Send several SCPI queries as a single message and split the response.
+    SCPI instruments answer "A?;B?;C?" with "a;b;c", so this costs one round
+    trip instead of one per query.
+
+    Args:
+        inst (object) : communication object with a query method, typically a
+            pyVisa Resource
+        queries (sequence of str) : queries, each ending with '?'
+
+    Returns:
+        list of str : one stripped response per query
+    """
+    response = inst.query(';'.join(queries)).strip().split(';')
+    if len(response) != len(queries):
+        raise ValueError('Expected {} responses to {!r}, got {!r}'.format(
+            len(queries), ';'.join(queries), response))
+    return [r.strip() for r in response]
+
+def identity(driver, refresh=False):
+    """
+    identity(driver, refresh=False)
+
+    Identity string (*IDN?) of the instrument behind driver.  The response is
+    cached on the driver, since it can't change during a session.
+
+    Args:
+        driver (object) : driver instance with an inst attribute
+        refresh (bool, optional) : True to query the instrument again
+
+    Returns:
+        str : stripped *IDN? response
+    """
+    if refresh or getattr(driver, '_idn', None) is None:
+        driver._idn = driver.inst.query('*IDN?').strip()
+    return driver._idn
+
+def diff_snapshots(old, new):
+    """
+    diff_snapshots(old, new)
+
+    Settings that differ between two snapshots.  The timestamp is ignored.
+
+    Args:
+        old (dict or None) : previous snapshot.  None returns all of new.
+        new (dict) : current snapshot
+
+    Returns:
+        dict : {key: (old value, new value)} for every changed key
+    """
+    if old is None:
+        old = {}
+    keys = set(old) | set(new)
+    keys.discard('timestamp')
+    return dict((k, (old.get(k), new.get(k))) for k in sorted(keys)
+                if old.get(k) != new.get(k))
+
+def save_snapshot(snapshot, write_to):
+    """
+    save_snapshot(snapshot, write_to)
+
+    Append a snapshot to a file as one line of compact JSON.
+
+    Args:
+        snapshot (dict) : snapshot to save
+        write_to (str) : file name
+    """
+    with open(write_to, 'a') as f:
+        f.write(json.dumps(snapshot, separators=(',', ':'), sort_keys=True))
+        f.write('\n')
+
+def load_snapshots(read_from):
+    """
+    load_snapshots(read_from)
+
+    Read every snapshot saved with save_snapshot from a file.
+
+    Args:
+        read_from (str) : file name
+
+    Returns:
+        list of dict : snapshots in the order they were saved
+    """
+    with open(read_from) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -1,8 +1,17 @@
 from __future__ import print_function
 import numpy as np
-from scipy.special import iv
 import math
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .snapshot import query_many, identity
+from . import session
+from . import binblock
+from .trace import Trace, Waterfall, resolve_dtype
+
+# Error code of a pyVisa timeout (pyvisa.constants.VI_ERROR_TMO)
+_VI_ERROR_TMO = -1073807339
+
 def prop_doc(var):
     s1 = '{} = property(get_{}, set_{})\n\n'.format(var, var, var)
     s2 = 'See help on get_{} and set_{} functions for info.'.format(var, var)
@@ -11,13 +20,37 @@ def prop_doc(var):
 def timestamp():
     return datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')
 
+def kaiser_enbw(samples, acq_time):
+    """
+    kaiser_enbw(samples, acq_time)
+
+    Effective noise bandwidth of the Kaiser window used by the Tek5103.
+
+    Args:
+        samples (int) : number of acquisition samples
+        acq_time (float) : acquisition time in seconds
+
+    Returns:
+        float : effective noise bandwidth in Hz
+    """
+    from scipy.special import iv
+    pi = np.pi
+    alpha = 16.7/pi
+    N = int(samples)
+    fs = N/acq_time
+    z = 2.*np.arange(N)/N - 1.
+    x = iv(0,pi*alpha*np.sqrt(1-z**2))/iv(0,pi*alpha)
+    return fs*np.sum(x**2)/np.sum(x)**2
+
 class AgilentESA(object):
 
     frequencies={'Hz':1.,'kHz':1000.,'MHz':1000000.,'GHz':1000000000.}
 
     def __init__(self, inst, freq_unit = 'MHz'):
         self.inst = inst
-        self.inst.write(':FORMat:TRACE:DATA ASCii')
+        # Traces are sent as big-endian float32 binary blocks
+        self.inst.write(':FORMat:TRACE:DATA REAL,32')
+        self.inst.write(':FORMat:BORDer NORMal')
         self._freq_unit = freq_unit
 
     def  __repr__(self):
@@ -85,16 +118,15 @@ class AgilentESA(object):
 
     freq_span  = property(get_freq_span, set_freq_span)
 
-    def fetch_spectrum_trace(self, trace):
-        y = self.inst.query_ascii_values(':TRACE? TRACE{}'.format(trace))
+    def fetch_spectrum_trace(self, trace, out=None, dtype=None):
+        y = binblock.query_block(self.inst, ':TRACE? TRACE{}'.format(trace),
+            'f', True, out=out, dtype=dtype)
         return y
 
-    def fetch_spectrum(self, trace):
-        y = self.fetch_spectrum_trace(trace)
-        x0 = self.start_freq
-        xf = self.stop_freq
-        x = np.linspace(x0, xf, len(y))
-        return x, y
+    def fetch_spectrum(self, trace, out=None):
+        y = self.fetch_spectrum_trace(trace, out, resolve_dtype(None, self))
+        return Trace(y, self.start_freq, stop=self.stop_freq,
+                     x_unit=self.freq_unit)
 
 
 class KeysightPXA(object):
@@ -103,7 +135,11 @@ class KeysightPXA(object):
 
     def __init__(self, inst, freq_unit = 'MHz'):
         self.inst = inst
-        self.inst.write(':FORMat:TRACE:DATA ASCii')
+        # Data is sent as big-endian float64 binary blocks.  float64 rather
+        # than float32 so carrier frequencies in the phase noise results keep
+        # their resolution.
+        self.inst.write(':FORMat:TRACE:DATA REAL,64')
+        self.inst.write(':FORMat:BORDer NORMal')
         self._freq_unit = freq_unit
 
     def  __repr__(self):
@@ -174,25 +210,43 @@ class KeysightPXA(object):
 
     freq_span  = property(get_freq_span, set_freq_span)
 
-    def fetch_spectrum_trace(self, trace):
-        y = self.inst.query_ascii_values(':TRACE? TRACE{}'.format(trace))
+    def fetch_spectrum_trace(self, trace, out=None, dtype=None):
+        y = binblock.query_block(self.inst, ':TRACE? TRACE{}'.format(trace),
+            'd', True, out=out, dtype=dtype)
         return y
 
-    def fetch_spectrum(self, trace):
-        y = self.fetch_spectrum_trace(trace)
-        x0 = self.start_freq
-        xf = self.stop_freq
-        x = np.linspace(x0, xf, len(y))
-        return x, y
-
-    def fetch_phasenoise(self, trace):
-        _y = self.inst.query_ascii_values(':FETCH:LPLOT{}?'.format(trace+2))
-        _meta = self.inst.query_ascii_values(':FETCH:LPLOT1?')
-        meta = {'carrier_power': '{} dBm'.format(_meta[0]),
-        'carrier_frequency': '{} Hz'.format(_meta[1])}
-        x = _y[0:-2:2]
-        y = _y[1:-1:2]
-        return x, y, meta
+    def fetch_spectrum(self, trace, out=None):
+        y = self.fetch_spectrum_trace(trace, out, resolve_dtype(None, self))
+        return Trace(y, self.start_freq, stop=self.stop_freq,
+                     x_unit=self.freq_unit)
+
+    def fetch_phasenoise(self, trace, meta=True):
+        """
+        fetch_phasenoise(self, trace, meta=True)
+
+        Log plot trace of the phase noise measurement, as one binary transfer.
+
+        Args:
+            trace (int) : trace number
+            meta (bool, optional) : also fetch the carrier power and frequency
+
+        Returns:
+            tuple : numpy array of offset frequencies in Hz, numpy array of
+                phase noise in dBc/Hz (both views of one transfer buffer),
+                dict of carrier_power in dBm and carrier_frequency in Hz, or
+                None if meta is False
+        """
+        _y = binblock.query_block(self.inst,
+            ':FETCH:LPLOT{}?'.format(trace+2), 'd', True)
+        # The trace interleaves (offset, phase noise) pairs
+        pairs = _y[:len(_y)//2*2].reshape(-1, 2)
+        x = pairs[:, 0]
+        y = pairs[:, 1]
+        if not meta:
+            return x, y, None
+        _meta = binblock.query_block(self.inst, ':FETCH:LPLOT1?', 'd', True)
+        return x, y, {'carrier_power': float(_meta[0]),
+                      'carrier_frequency': float(_meta[1])}
 
 class Tek5103(object):
     """
@@ -309,44 +363,60 @@ class Tek5103(object):
 
 #############################Data Transfer################################
 
-    def fetch_spectrum_trace(self,trace):
+    def fetch_spectrum_trace(self,trace,out=None,dtype=None):
         """
         Takes the spectrum data currently stored in the RSA.  To acquire a
         single fresh run, use read_spectrum(trace)
         Returns frequency,power in units unit,dB 
 
+        out (array, optional) is filled with the trace and reused if it is
+        large enough, so repeated fetches allocate nothing.  dtype sets the
+        type of a new array, float32 (the analyzer's own format) by default.
         """
-        return self.inst.query_binary_values('FETCH:SPECTRUM:TRACE{}?'.format(trace))
+        return binblock.query_block(self.inst,
+            'FETCH:SPECTRUM:TRACE{}?'.format(trace), out=out, dtype=dtype)
 
-    def fetch_spectrum(self,trace,unit=None):
+    def fetch_spectrum(self,trace,unit=None,out=None,snapshot=False):
         """
-        fetch_spectrum(self, trace, unit=None)
+        fetch_spectrum(self, trace, unit=None, out=None, snapshot=False)
 
         fetch the current spectrum waveform from trace
 
         Args:
             trace (int) : { 1 | 2 | 3 | 4 } corresponding to trace to retrieve
             unit (str, optional): { GHz | MHz | kHz | Hz } unit for frequency axis
+            out (array, optional) : array to receive the spectrum, reused
+                when it is large enough
+            snapshot (bool, optional) : store the analyzer settings (see
+                snapshot) in the returned Trace
 
         Returns:
-            x, y : numpy arrays corresponding to the x-axis and the spectrum
+            Trace : the spectrum in dBm, unpacks as x, y
         """
-        y=self.fetch_spectrum_trace(trace)
-        x=np.linspace(self.get_start_freq(unit),self.get_stop_freq(unit),len(y))
-        return x,np.array(y)
+        y=self.fetch_spectrum_trace(trace,out,resolve_dtype(None,self))
+        return self._trace(y,trace,unit,snapshot)
+
+    def _trace(self,y,trace,unit,snapshot):
+        # Spectrum with its frequency axis, and optionally the settings
+        if unit is None:
+            unit=self.freq_unit
+        settings=self.snapshot(trace) if snapshot else None
+        return Trace(y,self.get_start_freq(unit),stop=self.get_stop_freq(unit),
+                     x_unit=unit,y_unit='dBm',settings=settings)
 
-    def read_spectrum_trace(self,trace,unit=None):
+    def read_spectrum_trace(self,trace,unit=None,out=None,dtype=None):
         '''
         Take the spectrum data for the next acquisition from the
         analzyer.  To pull the current data, use fetch_spectrum(trace).
         
         Returns frequency,power in units unit,dB
         '''
-        return self.inst.query_binary_values('READ:SPECTRUM:TRACE{}?'.format(trace))
+        return binblock.query_block(self.inst,
+            'READ:SPECTRUM:TRACE{}?'.format(trace), out=out, dtype=dtype)
 
-    def read_spectrum(self,trace,unit=None):
+    def read_spectrum(self,trace,unit=None,out=None,snapshot=False):
         """
-        read_spectrum(self, trace, unit=None)
+        read_spectrum(self, trace, unit=None, out=None, snapshot=False)
 
         Acquires a new spectrum.
         This differs from fetch_spectrum in that it causes the analyzer to
@@ -356,14 +426,18 @@ class Tek5103(object):
         Args:
             trace (int) : { 1 | 2 | 3 | 4 } corresponding to trace to retrieve
             unit (str, optional): { GHz | MHz | kHz | Hz } unit for frequency axis
+            out (array, optional) : array to receive the spectrum, reused
+                when it is large enough
+            snapshot (bool, optional) : store the analyzer settings (see
+                snapshot) in the returned Trace
 
         Returns:
-            x, y : numpy arrays corresponding to the x-axis and the spectrum
+            Trace : the spectrum in dBm, unpacks as x, y
         """
 
-        y=self.read_spectrum_trace(trace)
-        x=np.linspace(self.get_start_freq(unit),self.get_stop_freq(unit),len(y))
-        return x,np.array(y)
+        y=self.read_spectrum_trace(trace,out=out,
+            dtype=resolve_dtype(None,self))
+        return self._trace(y,trace,unit,snapshot)
 
 #############################Frequency Commands################################
 
@@ -703,9 +777,159 @@ class Tek5103(object):
 
     def acquire(self):
         """start acquisistion"""
-        self.inst.write('INIT')
+        # Arming is latency critical, go ahead of queued trace transfers
+        with session.transaction(self.inst, session.URGENT):
+            self.inst.write('INIT')
 
 
+#############################Event-driven acquisition################################
+
+    def start_acquisition(self, use_srq=False):
+        """
+        start_acquisition(self, use_srq=False)
+
+        Start a single acquisition and return at once.  The analyzer sets the
+        operation complete bit when the acquisition finishes, see
+        acquisition_complete and wait_acquisition.  The analyzer is switched
+        to single acquisitions (INIT:CONT OFF) until end_acquisition restores
+        the mode it was in.
+
+        Args:
+            use_srq (bool, optional) : also request service (SRQ) on
+                completion, for wait_acquisition(use_srq=True)
+        """
+        with session.transaction(self.inst, session.URGENT):
+            if getattr(self, '_continuous', None) is None:
+                # Mode before the first of several start_acquisition calls
+                self._continuous = self.inst.query('INIT:CONT?').strip() in (
+                    '1', 'ON')
+            self.inst.write('INIT:CONT OFF')
+            self.inst.write('*CLS')
+            self.inst.write('*ESE 1')
+            self.inst.write('*SRE {}'.format(32 if use_srq else 0))
+            self.inst.write('INIT')
+            self.inst.write('*OPC')
+
+    def acquisition_complete(self):
+        """
+        acquisition_complete(self)
+
+        Poll the operation complete bit once.  The bit is cleared by reading
+        it, so this returns True only once per acquisition.
+
+        Returns:
+            bool : True if the acquisition started by start_acquisition is
+                complete
+        """
+        return bool(int(self.inst.query('*ESR?')) & 1)
+
+    def end_acquisition(self):
+        """
+        end_acquisition(self)
+
+        Return to continuous acquisition if the analyzer was in it before
+        start_acquisition.
+        """
+        continuous = getattr(self, '_continuous', None)
+        self._continuous = None
+        if continuous:
+            self.inst.write('INIT:CONT ON')
+
+    def wait_acquisition(self, timeout=60., poll=0.05, use_srq=False):
+        """
+        wait_acquisition(self, timeout=60., poll=0.05, use_srq=False)
+
+        Wait for the acquisition started by start_acquisition.  Unlike a READ
+        query, the bus is free for other instruments while the analyzer
+        integrates.
+
+        Args:
+            timeout (float, optional) : seconds to wait before raising
+                RuntimeError
+            poll (float, optional) : seconds between status polls
+            use_srq (bool, optional) : wait for the service request instead of
+                polling.  Needs start_acquisition(use_srq=True) and a
+                resource with wait_for_srq, e.g. a pyVisa GPIB Resource.
+        """
+        if use_srq:
+            # Wait on the raw resource, a LockedResource would hold the bus
+            resource = getattr(self.inst, 'resource', self.inst)
+            try:
+                from pyvisa.errors import VisaIOError
+            except ImportError:
+                # Without pyVisa there is no pyVisa timeout to catch
+                VisaIOError = ()
+            try:
+                resource.wait_for_srq(int(timeout*1000))
+            except VisaIOError as e:
+                if e.error_code != _VI_ERROR_TMO:
+                    raise
+                raise RuntimeError('No service request from analyzer after '
+                                   '{} s'.format(timeout))
+            self.inst.read_stb()
+            self.inst.query('*ESR?')
+            return
+        end = time.time() + timeout
+        while not self.acquisition_complete():
+            if time.time() > end:
+                raise RuntimeError('Acquisition not complete after '
+                                   '{} s'.format(timeout))
+            time.sleep(poll)
+
+    def acquire_spectrum(self, trace, unit=None, timeout=60., poll=0.05,
+            use_srq=False, out=None):
+        """
+        acquire_spectrum(self, trace, unit=None, timeout=60., poll=0.05,
+            use_srq=False, out=None)
+
+        Acquire a new spectrum like read_spectrum, but start the acquisition,
+        wait for completion without holding the bus, then fetch the trace.
+        The acquisition mode is restored afterwards, see end_acquisition.
+
+        Returns:
+            Trace : the spectrum in dBm, unpacks as x, y
+        """
+        self.start_acquisition(use_srq)
+        try:
+            self.wait_acquisition(timeout, poll, use_srq)
+            return self.fetch_spectrum(trace, unit, out)
+        finally:
+            self.end_acquisition()
+
+    def acquire_spectrum_async(self, trace, callback=None, unit=None,
+            timeout=60., poll=0.05, use_srq=False, out=None):
+        """
+        acquire_spectrum_async(self, trace, callback=None, unit=None,
+            timeout=60., poll=0.05, use_srq=False, out=None)
+
+        acquire_spectrum in a background thread, so the calling thread can
+        drive other instruments meanwhile.  Acquisitions of one analyzer run
+        one after another.
+
+        Args:
+            callback (callable, optional) : called as callback(x, y) when the
+                spectrum has been fetched
+            other args : see acquire_spectrum
+
+        Returns:
+            concurrent.futures.Future : resolves to the Trace.  In asyncio
+                code, await asyncio.wrap_future(future).
+
+        Examples:
+            >>> future = rsa.acquire_spectrum_async(1)
+            >>> hp.frequency = 100 # runs while the analyzer integrates
+            >>> x, y = future.result()
+        """
+        if getattr(self, '_executor', None) is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        def run():
+            result = self.acquire_spectrum(trace, unit, timeout, poll,
+                use_srq, out)
+            if callback is not None:
+                callback(*result)
+            return result
+        return self._executor.submit(run)
+
     def restart_acquire(self):
         """restart acquisition"""
         self.inst.write('SENSE:SPECTRUM:CLEAR:RESULTS')
@@ -771,6 +995,94 @@ class Tek5103(object):
     acq_samples = property(get_acq_samples,
         set_acq_samples,doc=prop_doc('acq_samples'))
 
+#############################Waterfall################################
+
+    def waterfall(self, trace, rows=None, duration=None, capacity=None,
+            interval=None, unit=None, filename=None, dtype=None,
+            callback=None, poll=0.01):
+        """
+        waterfall(self, trace, rows=None, duration=None, capacity=None,
+            interval=None, unit=None, filename=None, dtype=None,
+            callback=None, poll=0.01)
+
+        Fetch a trace over and over into a Waterfall, a preallocated ring
+        buffer of spectra with one timestamp per row.  Every spectrum is
+        received into one reused buffer and copied into the ring when it is
+        kept.  The frequency axis is read once and shared by all rows.  A
+        fetch that returns the same data as the row before (the analyzer has
+        not updated yet) is not kept, and the next fetch waits poll seconds.
+        Stop early with Ctrl-C; the rows so far are kept.
+
+        Args:
+            trace (int) : { 1 | 2 | 3 | 4 } corresponding to trace to retrieve
+            rows (int, optional) : number of spectra to take
+            duration (float, optional) : seconds to run for.  At least one of
+                rows and duration must be given; the capture stops at
+                whichever comes first.
+            capacity (int, optional) : rows held, the oldest are overwritten
+                beyond that.  Default is rows, or 1000.
+            interval (float, optional) : seconds between fetches.  Default is
+                as fast as the analyzer updates.  Also the expected gap for
+                drop detection.
+            unit (str, optional) : { GHz | MHz | kHz | Hz } unit for frequency
+                axis
+            filename (str, optional) : .npy file to memory-map the rows to,
+                see Waterfall
+            dtype (optional) : dtype of the rows.  Default is the dtype
+                attribute of this analyzer if set, else float32 like
+                Waterfall, not the package-wide dtype.
+            callback (callable, optional) : called as callback(waterfall)
+                after every row kept, e.g. to update a plot
+            poll (float, optional) : seconds to wait after a fetch that
+                returned no new spectrum, so the bus isn't polled flat out
+
+        Returns:
+            Waterfall : the spectra.  wf.result() gives a 2D Trace and the
+                timestamps; wf.dropped counts rows missed.
+        """
+        if rows is None and duration is None:
+            raise ValueError('waterfall needs rows or duration')
+        if capacity is None:
+            capacity = rows if rows is not None else 1000
+        if unit is None:
+            unit = self.freq_unit
+        if dtype is None:
+            dtype = getattr(self, 'dtype', None) or np.float32
+        # The first spectrum sets the number of points
+        first = self.fetch_spectrum_trace(trace, dtype=dtype)
+        t = time.time()
+        start, stop = self.get_start_freq(unit), self.get_stop_freq(unit)
+        wf = Waterfall(capacity, len(first), start,
+                       (stop - start)/max(len(first) - 1, 1), x_unit=unit,
+                       y_unit='dBm', settings=self.snapshot(trace),
+                       dtype=dtype, filename=filename, interval=interval)
+        wf.add(first, t)
+        # Fetched into first, so a repeated spectrum never overwrites the
+        # oldest row of the ring
+        scratch = first
+        end = None if duration is None else t + duration
+        try:
+            while rows is None or wf.count < rows:
+                if interval is not None:
+                    wait = t + interval - time.time()
+                    if wait > 0:
+                        time.sleep(wait)
+                if end is not None and time.time() >= end:
+                    break
+                y = self.fetch_spectrum_trace(trace, out=scratch)
+                stamp = time.time()
+                if np.array_equal(y, wf.row(-1).y):
+                    time.sleep(poll)
+                    continue
+                t = stamp
+                wf.add(y, t)
+                if callback is not None:
+                    callback(wf)
+        except KeyboardInterrupt:
+            pass
+        wf.flush()
+        return wf
+
 #############################GPIB################################
 
     def set_gpib(self,address):
@@ -884,43 +1196,57 @@ class Tek5103(object):
         Returns:
             float : effective noise bandwidth in Hz
         """
-        pi = np.pi
-        alpha = 16.7/pi
-        N=self.acq_samples
-        tau=self.acq_time
-        fs=N/tau
-        j=np.arange(N)
-        def kaiser(j):
-            z = 2.*j/N - 1.
-            return iv(0,pi*alpha*np.sqrt(1-z**2))/iv(0,pi*alpha)
-        def S1(x):
-            sum = 0
-            for i in x:
-                sum = sum+i
-            return sum
-
-        def S2(x):
-            sum = 0
-            for i in x:
-                sum = sum+i**2
-            return sum
-        x=kaiser(j)
-        return fs*S2(x)/S1(x)**2
+        return kaiser_enbw(self.acq_samples, self.acq_time)
+
+    def snapshot(self, trace, name=None):
+        """
+        snapshot(self, trace, name=None)
+
+        Record the analyzer settings with a single combined query.  The ENBW
+        is computed from the acquisition settings without further queries.
+
+        Args:
+            trace (int) : trace whose averaging is recorded
+            name (str, optional) : nickname stored with the snapshot
+
+        Returns:
+            dict : timestamp, name, idn, center_freq, freq_span, rbw,
+                freq_unit, averaging, acq_time, acq_samples and enbw
+        """
+        center, span, rbw, avg, acq_time, acq_samples = query_many(self.inst,
+            ('SENS:SPEC:FREQ:CENT?', 'SENS:SPEC:FREQ:SPAN?',
+             'SENS:SPEC:BAND:RES:ACT?', 'TRAC{}:SPEC:AVER:COUN?'.format(trace),
+             'SENSE:ACQUISITION:SECONDS?', 'SENSE:ACQUISITION:SAMPLES?'))
+        unit = self.frequencies[self.freq_unit]
+        return {'timestamp': timestamp(),
+                'name': name,
+                'instrument': 'Tek5103',
+                'idn': identity(self),
+                'trace': trace,
+                'center_freq': float(center)/unit,
+                'freq_span': float(span)/unit,
+                'rbw': float(rbw)/unit,
+                'freq_unit': self.freq_unit,
+                'averaging': float(avg),
+                'acq_time': float(acq_time),
+                'acq_samples': float(acq_samples),
+                'enbw': kaiser_enbw(float(acq_samples), float(acq_time))}
 
     def state(self, trace, write_to=None, name=None):
+        snap = self.snapshot(trace, name)
         s = []
-        s.append('{}\n'.format(timestamp()))
+        s.append('{}\n'.format(snap['timestamp']))
         if name is not None:
             s.append('nickname: {}\n'.format(name))
-        s.append('{}'.format(self.inst.query('*IDN?')))
-        s.append('Center Frequency: {} {}\n'.format(self.center_freq, 
-            self.freq_unit))
-        s.append('Span: {} {}\n'.format(self.freq_span, self.freq_unit))
-        s.append('RBW: {} {}\n'.format(self.rbw, self.freq_unit))
-        s.append('Averaging: {}\n'.format(self.get_averaging(trace)))
-        s.append('Acquisition Time: {} S\n'.format(self.acq_time))
-        s.append('Acquisition Samples: {}\n'.format(self.acq_samples))
-        s.append('ENBW: {} Hz\n'.format(self.enbw()))
+        s.append('{}\n'.format(snap['idn']))
+        s.append('Center Frequency: {} {}\n'.format(snap['center_freq'],
+            snap['freq_unit']))
+        s.append('Span: {} {}\n'.format(snap['freq_span'], snap['freq_unit']))
+        s.append('RBW: {} {}\n'.format(snap['rbw'], snap['freq_unit']))
+        s.append('Averaging: {}\n'.format(snap['averaging']))
+        s.append('Acquisition Time: {} S\n'.format(snap['acq_time']))
+        s.append('Acquisition Samples: {}\n'.format(snap['acq_samples']))
+        s.append('ENBW: {} Hz\n'.format(snap['enbw']))
         if write_to is None:
             for line in s:
                 print(line,end='')
@@ -938,9 +1264,11 @@ class Tek5103Functions(Tek5103):
         self.freq_unit=freq_unit
         self.time_unit=time_unit
 
-    def stitch_scans(self,start_freq,stop_freq,trace=None,scan_width=None):
+    def stitch_scans(self,start_freq,stop_freq,trace=None,scan_width=None,
+            checkpoint=None):
         """
-        stitch_scans(self, start_freq, stop_freq, trace=None, scan_width=None)
+        stitch_scans(self, start_freq, stop_freq, trace=None, scan_width=None,
+            checkpoint=None)
 
         stitches together multiple scans, from start_freq to stop_freq,
         returning a single x and y axis for the spectrum over the full range. 
@@ -954,28 +1282,64 @@ class Tek5103Functions(Tek5103):
             scan_width(float, optional) : analysis frequency span to use for
                 the individual scans.  Defaults to using the current frequency
                 span.
+            checkpoint (str or Checkpoint, optional) : directory to record
+                every finished scan in (see utils.checkpoint).  Calling
+                stitch_scans again with the same arguments and checkpoint
+                resumes after the last finished scan.
 
         Returns:
-            x, y : the frequency axis (x) and spectrum (y) as numpy arrays
-                with floating point values.
+            Trace : the spectrum, with the frequency axis as an explicit x
+                array since the scans' axes join unevenly.  Unpacks as x, y.
         """
+        from ..utils.checkpoint import Checkpoint
         if trace is None:
             trace=1
         if scan_width is None:
             scan_width=self.freq_span
-        x=np.array([])
-        y=np.array([])
-        scans=math.ceil(float(stop_freq-start_freq)/float(scan_width))
+        scans=int(math.ceil(float(stop_freq-start_freq)/float(scan_width)))
         self.freq_span=scan_width
-        self.center_freq=start_freq+0.5*scan_width
+        first=0
+        if checkpoint is not None:
+            if not isinstance(checkpoint, Checkpoint):
+                checkpoint=Checkpoint(checkpoint)
+            first=checkpoint.start({'start_freq':start_freq,
+                'stop_freq':stop_freq, 'trace':trace, 'scan_width':scan_width,
+                'freq_unit':self.freq_unit}, [self.snapshot(trace)])
+        self.center_freq=start_freq+(first+0.5)*scan_width
         print(self.start_freq)
-        for i in range(int(scans)):
+        # Only the start and step of every scan's axis are kept, the full x
+        # axis is built once at the end
+        starts=[]
+        steps=[]
+        y=[]
+        for i in range(first,scans):
             print('scan {} of {}'.format(i,scans))
-            a,b=self.read_spectrum(trace)
-            x=np.append(x,a)
-            y=np.append(y,b)
-            self.center_freq+=scan_width
-        return x,y
+            # Set the center directly rather than stepping it, so a resumed
+            # scan lands on the same frequencies
+            self.center_freq=start_freq+(i+0.5)*scan_width
+            scan=self.read_spectrum(trace)
+            if checkpoint is None:
+                starts.append(scan.start)
+                steps.append(scan.step)
+                y.append(scan.y)
+            else:
+                checkpoint.array('x',(scans,scan.n),np.float64)[i]=scan.x
+                checkpoint.array('y',(scans,scan.n),scan.y.dtype)[i]=scan.y
+                checkpoint.commit(i+1)
+        if checkpoint is not None:
+            checkpoint.finish()
+        if scans<=0:
+            # Nothing to scan, stop_freq is not above start_freq
+            x=np.array([])
+            y=np.array([])
+        elif checkpoint is None:
+            y=np.concatenate(y)
+            x=(np.array(starts)[:,None]
+               +np.array(steps)[:,None]*np.arange(len(y)//len(steps))).ravel()
+        else:
+            x=np.ravel(checkpoint.array('x'))
+            y=np.ravel(checkpoint.array('y'))
+        return Trace(y,x=x,x_unit=self.freq_unit,y_unit='dBm')
 
     def step(self,step_size):
         """Increment the center frequency"""
@@ -995,25 +1359,4 @@ class Tek5103Functions(Tek5103):
         Returns:
             float : effective noise bandwidth in Hz
         """
-        pi = np.pi
-        alpha = 16.7/pi
-        N=self.acq_samples
-        tau=self.acq_time
-        fs=N/tau
-        j=np.arange(N)
-        def kaiser(j):
-            z = 2.*j/N - 1.
-            return iv(0,pi*alpha*np.sqrt(1-z**2))/iv(0,pi*alpha)
-        def S1(x):
-            sum = 0
-            for i in x:
-                sum = sum+i
-            return sum
-
-        def S2(x):
-            sum = 0
-            for i in x:
-                sum = sum+i**2
-            return sum
-        x=kaiser(j)
-        return fs*S2(x)/S1(x)**2
+        return kaiser_enbw(self.acq_samples, self.acq_time)
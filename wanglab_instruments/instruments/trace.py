@@ -0,0 +1,391 @@
+import time
+import numpy as np
+
+###################### Data types ###############################
+#
+# Fetched y data is float64 by default.  Analyzer traces are float32 and scope
+# samples 8 or 16 bit on the wire, so float32 loses nothing and halves the
+# memory of long records, stitched scans, averages and checkpoints.  The
+# policy is set for the whole package with set_default_dtype, or for one
+# driver by setting its dtype attribute, e.g. rsa.dtype = np.float32.  x axes
+# stay float64, float32 can't resolve e.g. Hz steps at GHz.
+
+_default_dtype = np.dtype(np.float64)
+
+def set_default_dtype(dtype):
+    """
+    set_default_dtype(dtype)
+
+    Set the package-wide dtype of fetched data, averages and stored arrays.
+
+    Args:
+        dtype : np.float32 or np.float64
+    """
+    global _default_dtype
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('dtype = { float32 | float64 }')
+    _default_dtype = dtype
+
+def get_default_dtype():
+    """The package-wide dtype set by set_default_dtype"""
+    return _default_dtype
+
+def resolve_dtype(dtype=None, owner=None):
+    """
+    resolve_dtype(dtype=None, owner=None)
+
+    dtype to use for data: dtype if given, else the dtype attribute of owner
+    (e.g. a driver) if it has one, else the package-wide default.
+    """
+    if dtype is None:
+        dtype = getattr(owner, 'dtype', None)
+    if dtype is None:
+        return _default_dtype
+    return np.dtype(dtype)
+
+def scale(raw, gain, offset=0., zero=0., dtype=None):
+    """
+    scale(raw, gain, offset=0., zero=0., dtype=None)
+
+    (raw - offset)*gain + zero, computed in place in one array of the given
+    dtype, without float64 temporaries.
+
+    Args:
+        raw (array) : raw samples, e.g. int16 scope data
+        gain, offset, zero (float) : scaling
+        dtype (optional) : dtype of the result, see resolve_dtype
+
+    Returns:
+        array : scaled values
+    """
+    y = np.empty(np.shape(raw), dtype=resolve_dtype(dtype))
+    np.subtract(raw, offset, out=y)
+    y *= gain
+    if zero:
+        y += zero
+    return y
+
+###################### Traces ###############################
+#
+# The fetch methods of the drivers return a Trace.  A Trace unpacks like the
+# (x, y) tuple the drivers used to return, so "x, y = rsa.fetch_spectrum(1)"
+# keeps working, but a uniform x axis is only stored as (start, step) and
+# built when it is asked for.
+
+class Trace(object):
+    """
+    Initialize Trace class object
+
+    y data with its x axis, units and optionally the instrument settings it
+    was taken with.  The x axis is either uniform, given by start and step
+    (or stop, as in numpy.linspace), or an explicit array.
+
+    Args:
+        y (array) : data.  The x axis runs along the last dimension.
+        start (float, optional) : x of the first point of a uniform axis
+        step (float, optional) : x increment of a uniform axis
+        stop (float, optional) : x of the last point of a uniform axis,
+            instead of step
+        x (array, optional) : explicit x axis, instead of start and step
+        x_unit (str, optional) : unit of x
+        y_unit (str, optional) : unit of y
+        settings (dict, optional) : instrument settings, e.g. a snapshot
+        dtype (optional) : dtype to store y with.  Default keeps y as is.
+
+    Examples:
+        >>> trace = rsa.fetch_spectrum(1)
+        >>> x, y = trace
+        >>> trace.start, trace.step, trace.x_unit
+        (99.5, 0.0003125, 'MHz')
+    """
+
+    __slots__ = ('y', 'start', 'step', '_x', 'x_unit', 'y_unit', 'settings')
+
+    def __init__(self, y, start=None, step=None, stop=None, x=None,
+            x_unit='', y_unit='', settings=None, dtype=None):
+        self.y = np.asarray(y, dtype=dtype)
+        self._x = None
+        self.start = start
+        self.step = step
+        if x is not None:
+            self._x = np.asarray(x)
+            if self._x.shape[-1] != self.y.shape[-1]:
+                raise ValueError('x has {} points, y has {}'.format(
+                    self._x.shape[-1], self.y.shape[-1]))
+        elif start is None:
+            raise TypeError('Trace needs start and step (or stop), or x')
+        elif step is None:
+            if stop is None:
+                raise TypeError('Trace needs start and step (or stop), or x')
+            self.step = (stop - start)/max(self.n - 1, 1)
+        self.x_unit = x_unit
+        self.y_unit = y_unit
+        self.settings = settings
+
+    def __repr__(self):
+        if self.uniform:
+            axis = 'start={!r}, step={!r}'.format(self.start, self.step)
+        else:
+            axis = 'x=<{} points>'.format(self.n)
+        return 'Trace(<{} {}>, {}, x_unit={!r}, y_unit={!r})'.format(
+            self.y.shape, self.y.dtype, axis, self.x_unit, self.y_unit)
+
+    @property
+    def n(self):
+        """number of points along x"""
+        return self.y.shape[-1] if self.y.ndim else 1
+
+    @property
+    def uniform(self):
+        """True if x is stored as start and step"""
+        return self._x is None
+
+    @property
+    def x(self):
+        """x axis.  Built on every access for a uniform axis."""
+        if self._x is not None:
+            return self._x
+        return self.start + self.step*np.arange(self.n)
+
+    @property
+    def stop(self):
+        """x of the last point"""
+        if self._x is not None:
+            return self._x[..., -1]
+        return self.start + self.step*(self.n - 1)
+
+    def index(self, value):
+        """
+        index(self, value)
+
+        Index of the point with x closest to value, without building a
+        uniform x axis.
+
+        Args:
+            value (float or array) : x value(s)
+
+        Returns:
+            int or array : index
+        """
+        if self._x is None:
+            i = np.rint((np.asarray(value) - self.start)/self.step)
+            return np.clip(i, 0, self.n - 1).astype(int)
+        i = np.clip(np.searchsorted(self._x, value), 1, self.n - 1)
+        left = self._x[i - 1]
+        return np.where(np.abs(value - left) <= np.abs(self._x[i] - value),
+                        i - 1, i)
+
+    def astype(self, dtype):
+        """Copy of the trace with y converted to dtype."""
+        return Trace(self.y.astype(dtype), self.start, self.step, x=self._x,
+                     x_unit=self.x_unit, y_unit=self.y_unit,
+                     settings=self.settings)
+
+    # Behave like the (x, y) tuple the drivers used to return
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, i):
+        return (self.x, self.y)[i]
+
+###################### Waterfalls ###############################
+
+class Waterfall(object):
+    """
+    Initialize Waterfall class object
+
+    Ring buffer of repeated traces sharing one x axis, e.g. spectra stacked
+    over time for drift studies.  Rows are written in place into a 2D array
+    allocated once, optionally memory-mapped to a .npy file, so a long
+    capture never grows.  When the buffer is full the oldest rows are
+    overwritten.  Every row has a timestamp, and gaps between timestamps
+    longer than the expected interval are recorded as dropped rows.
+
+    Args:
+        capacity (int) : number of rows held
+        points (int) : points per row
+        start (float, optional) : x of the first point
+        step (float, optional) : x increment
+        x_unit (str, optional) : unit of x
+        y_unit (str, optional) : unit of y
+        settings (dict, optional) : instrument settings, e.g. a snapshot
+        dtype (optional) : dtype of the rows.  Default is float32, whatever
+            the package-wide dtype, since a long capture is all about memory
+            and analyzer traces are float32 anyway.
+        filename (str, optional) : .npy file to memory-map the rows to.  The
+            timestamps go to a second file ending in _times.npy.  Rows are in
+            ring order on disk, the timestamps give their order.
+        interval (float, optional) : expected seconds between rows.  Default
+            is the running mean of the gaps between rows.
+        tolerance (float, optional) : a gap longer than (1 + tolerance)
+            times the interval counts as dropped rows
+
+    Examples:
+        >>> wf = rsa.waterfall(1, duration=3600, interval=1, capacity=3600,
+        ...                    filename='drift.npy')
+        >>> spectra, times = wf.result()
+        >>> wf.dropped
+        0
+    """
+
+    def __init__(self, capacity, points, start=0., step=1., x_unit='',
+            y_unit='', settings=None, dtype=np.float32, filename=None,
+            interval=None, tolerance=0.5):
+        shape = (int(capacity), int(points))
+        if filename is None:
+            self.data = np.empty(shape, dtype=dtype)
+            self.stamps = np.full(shape[0], np.nan)
+        else:
+            base = filename[:-4] if filename.endswith('.npy') else filename
+            self.data = np.lib.format.open_memmap(base + '.npy', mode='w+',
+                dtype=dtype, shape=shape)
+            self.stamps = np.lib.format.open_memmap(base + '_times.npy',
+                mode='w+', dtype=np.float64, shape=shape[:1])
+            self.stamps[...] = np.nan
+        self.filename = filename
+        self.start = start
+        self.step = step
+        self.x_unit = x_unit
+        self.y_unit = y_unit
+        self.settings = settings
+        self.interval = interval
+        self.tolerance = tolerance
+        self.count = 0
+        # (row number, rows missed before it) for every gap
+        self.gaps = []
+        self._gap_sum = 0.
+        self._gap_count = 0
+
+    def __repr__(self):
+        return 'Waterfall({} of {} rows, {} points, {} dropped)'.format(
+            len(self), self.capacity, self.points, self.dropped)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def capacity(self):
+        """number of rows held"""
+        return self.data.shape[0]
+
+    @property
+    def points(self):
+        """points per row"""
+        return self.data.shape[1]
+
+    @property
+    def x(self):
+        """x axis shared by all rows"""
+        return self.start + self.step*np.arange(self.points)
+
+    @property
+    def overwritten(self):
+        """number of rows lost to the ring wrapping around"""
+        return max(self.count - self.capacity, 0)
+
+    @property
+    def dropped(self):
+        """number of rows missed according to the timestamps"""
+        return sum(missed for row, missed in self.gaps)
+
+    def next_row(self):
+        """
+        next_row(self)
+
+        The row the next trace goes into, to be filled in place (e.g. as the
+        out argument of a fetch) and then committed with commit.
+
+        Returns:
+            array : view of the row
+        """
+        return self.data[self.count % self.capacity]
+
+    def commit(self, t=None):
+        """
+        commit(self, t=None)
+
+        Keep the row returned by next_row.
+
+        Args:
+            t (float, optional) : timestamp in seconds.  Default is now.
+        """
+        if t is None:
+            t = time.time()
+        if self.count:
+            gap = t - self.stamps[(self.count - 1) % self.capacity]
+            interval = self.interval
+            if interval is None and self._gap_count:
+                interval = self._gap_sum/self._gap_count
+            if interval and gap > (1 + self.tolerance)*interval:
+                self.gaps.append((self.count,
+                                  max(int(round(gap/interval)) - 1, 1)))
+            else:
+                self._gap_sum += gap
+                self._gap_count += 1
+        self.stamps[self.count % self.capacity] = t
+        self.count += 1
+
+    def add(self, y, t=None):
+        """
+        add(self, y, t=None)
+
+        Copy a trace into the next row and commit it.
+        """
+        self.next_row()[...] = y
+        self.commit(t)
+
+    def _order(self):
+        # Buffer indices of the rows held, oldest first
+        if self.count <= self.capacity:
+            return slice(0, self.count)
+        first = self.count - self.capacity
+        return np.arange(first, self.count) % self.capacity
+
+    @property
+    def y(self):
+        """rows held, oldest first.  A view until the ring has wrapped."""
+        return self.data[self._order()]
+
+    @property
+    def times(self):
+        """timestamps of the rows held, oldest first"""
+        return self.stamps[self._order()]
+
+    def row(self, i=-1):
+        """
+        row(self, i=-1)
+
+        One row as a Trace, counting from the oldest row held (negative i
+        from the newest).
+        """
+        n = len(self)
+        if not -n <= i < n:
+            raise IndexError('row {} of {}'.format(i, n))
+        index = (self.count - n + i % n) % self.capacity
+        return Trace(self.data[index], self.start, self.step,
+                     x_unit=self.x_unit, y_unit=self.y_unit,
+                     settings=self.settings)
+
+    def result(self):
+        """
+        result(self)
+
+        Returns:
+            tuple : Trace of the rows held (2D, oldest first), numpy array of
+                their timestamps
+        """
+        return (Trace(self.y, self.start, self.step, x_unit=self.x_unit,
+                      y_unit=self.y_unit, settings=self.settings),
+                self.times)
+
+    def flush(self):
+        """Write a memory-mapped buffer to disk."""
+        if self.filename is not None:
+            self.data.flush()
+            self.stamps.flush()
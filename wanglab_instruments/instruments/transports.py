@@ -0,0 +1,448 @@
+import socket
+import time
+import numpy as np
+from . import binblock
+
+###################### Transports ###############################
+#
+# Communication objects with the pyVisa Resource interface (write, read,
+# query, query_ascii_values, query_binary_values, write_binary_values), for
+# instruments that are reached without VISA.  Any driver accepts them in
+# place of a pyVisa Resource.
+
+class _BufferedResource(object):
+    # pyVisa style interface on top of a byte stream.  Received bytes are
+    # kept in one buffer that is searched for the termination character in a
+    # single call per chunk.  Subclasses provide _send(data), _recv_into(view)
+    # (receive at least one byte into view, return the count), close() and
+    # the timeout property.
+
+    chunk_size = 65536
+
+    def __init__(self, read_termination='\n', write_termination='\n',
+            encoding='ascii'):
+        self.read_termination = read_termination
+        self.write_termination = write_termination
+        self.encoding = encoding
+        self._buf = bytearray()
+        self._chunk = bytearray(self.chunk_size)
+        self._chunk_view = memoryview(self._chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    #############################Low level################################
+
+    def _fill(self):
+        # Receive one chunk into the internal buffer
+        n = self._recv_into(self._chunk_view)
+        self._buf += self._chunk_view[:n]
+
+    def read_bytes(self, count):
+        """
+        read_bytes(self, count)
+
+        Read exactly count bytes.
+
+        Returns:
+            bytes : the data
+        """
+        out = bytearray(count)
+        self.read_into(memoryview(out))
+        return bytes(out)
+
+    def read_into(self, view):
+        """
+        read_into(self, view)
+
+        Fill a writable buffer (bytearray, memoryview or numpy array) with
+        exactly as many bytes as it holds.  Bytes already received are copied
+        first, the rest is received directly into the buffer.
+
+        Args:
+            view : writable buffer
+
+        Returns:
+            int : number of bytes read
+        """
+        view = memoryview(view).cast('B')
+        nbytes = len(view)
+        pos = min(len(self._buf), nbytes)
+        view[:pos] = self._buf[:pos]
+        del self._buf[:pos]
+        while pos < nbytes:
+            pos += self._recv_into(view[pos:])
+        return nbytes
+
+    def _read_until(self, term):
+        # Bytes up to and including term
+        start = 0
+        while True:
+            i = self._buf.find(term, start)
+            if i >= 0:
+                data = bytes(self._buf[:i + len(term)])
+                del self._buf[:i + len(term)]
+                return data
+            # The terminator may straddle two chunks
+            start = max(0, len(self._buf) - len(term) + 1)
+            self._fill()
+
+    def read_raw(self, size=None):
+        """
+        read_raw(self, size=None)
+
+        Read up to and including the termination character, as pyVisa does.
+        size, the chunk size in pyVisa, is not used.
+
+        Returns:
+            bytes : the response with the termination character
+        """
+        return self._read_until(self.read_termination.encode(self.encoding))
+
+    def write_raw(self, message):
+        """Send bytes as they are."""
+        self._send(message)
+
+    #############################pyVisa interface################################
+
+    def write(self, message, termination=None):
+        """Send a command."""
+        if termination is None:
+            termination = self.write_termination
+        self._send((message + termination).encode(self.encoding))
+
+    def read(self, termination=None):
+        """
+        read(self, termination=None)
+
+        Read a text response up to termination, default read_termination.
+
+        Returns:
+            str : the response without the termination character
+        """
+        if termination is None:
+            termination = self.read_termination
+        term = termination.encode(self.encoding)
+        return self._read_until(term)[:-len(term)].decode(self.encoding)
+
+    def query(self, message, delay=None):
+        """
+        query(self, message, delay=None)
+
+        Send a query and read its text response, waiting delay seconds in
+        between if given.
+        """
+        self.write(message)
+        if delay:
+            time.sleep(delay)
+        return self.read()
+
+    def query_pipelined(self, messages):
+        """
+        query_pipelined(self, messages)
+
+        Send several queries back to back in one write, then read all
+        responses.  Saves a round trip per query compared to query.
+
+        Args:
+            messages (sequence of str) : queries
+
+        Returns:
+            list of str : one response per query
+        """
+        term = self.write_termination
+        self._send(''.join(m + term for m in messages).encode(self.encoding))
+        return [self.read() for m in messages]
+
+    def query_ascii_values(self, message, converter='f', separator=',',
+            container=list, delay=None):
+        """
+        query_ascii_values(self, message, converter='f', separator=',',
+            container=list, delay=None)
+
+        Query comma separated numbers.  Values are converted by numpy in one
+        pass.
+        """
+        data = self.query(message, delay)
+        dtype = float if converter in ('f', 'e', 'g') else int
+        values = np.array(data.strip().split(separator), dtype=dtype)
+        if container is list:
+            return values.tolist()
+        return container(values)
+
+    def read_binary_block(self, datatype='f', is_big_endian=False, out=None,
+            expect_termination=True):
+        """
+        read_binary_block(self, datatype='f', is_big_endian=False, out=None,
+            expect_termination=True)
+
+        Read an IEEE 488.2 binary block into a numpy array, see
+        binblock.read_block.
+
+        Args:
+            datatype (str, optional) : struct format character of the values
+            is_big_endian (bool, optional) : byte order of the values
+            out (array, optional) : array to receive the values, reused if it
+                is large enough.  The data is received directly into it when
+                it has the block's dtype, otherwise converted.  A view of the
+                filled part is returned.
+            expect_termination (bool, optional) : consume the termination
+                character following the block
+
+        Returns:
+            array : the values
+        """
+        return binblock.read_block(self, datatype, is_big_endian, out,
+            expect_termination=expect_termination)
+
+    def query_binary_values(self, message, datatype='f', is_big_endian=False,
+            container=list, expect_termination=True, out=None):
+        """
+        query_binary_values(self, message, datatype='f', is_big_endian=False,
+            container=list, expect_termination=True, out=None)
+
+        Query an IEEE 488.2 binary block, see read_binary_block.  Pass
+        container=np.array to avoid converting the values to a list.
+        """
+        self.write(message)
+        values = self.read_binary_block(datatype, is_big_endian, out,
+            expect_termination)
+        if container is list:
+            return values.tolist()
+        if container is np.array or container is np.ndarray:
+            return values
+        return container(values)
+
+    def write_binary_values(self, message, values, datatype='f',
+            is_big_endian=False, termination=None):
+        """
+        write_binary_values(self, message, values, datatype='f',
+            is_big_endian=False, termination=None)
+
+        Send message followed by values as an IEEE 488.2 definite length
+        block.
+        """
+        if termination is None:
+            termination = self.write_termination
+        dtype = binblock.block_dtype(datatype, is_big_endian)
+        data = np.asarray(values).astype(dtype, copy=False).tobytes()
+        length = str(len(data))
+        header = '{}#{}{}'.format(message, len(length), length)
+        self._send(header.encode(self.encoding) + data
+                   + termination.encode(self.encoding))
+
+class SocketResource(_BufferedResource):
+    """
+    Initialize SocketResource class object
+
+    Raw SCPI over TCP (the "port 5025" socket interface of LAN instruments
+    such as the Tek5103, KeysightPXA and RSsmc100).  Large socket buffers are
+    requested, text responses are split on the termination character with a
+    single buffer search per received chunk, and binary blocks are received
+    directly into a preallocated numpy array with recv_into.
+
+    Args:
+        host (str) : host name or IP address of the instrument
+        port (int, optional) : TCP port.  Default 5025.
+        timeout (float, optional) : timeout in ms, as in pyVisa.  Default
+            10000.
+        read_termination (str, optional) : end of a text response.  Default
+            newline.
+        write_termination (str, optional) : appended to written commands.
+            Default newline.
+        buffer_size (int, optional) : requested socket send and receive
+            buffer size in bytes.  Default 4 MB.
+        encoding (str, optional) : text encoding.  Default ascii.
+
+    Examples:
+        >>> from wanglab_instruments.instruments.transports import SocketResource
+        >>> from wanglab_instruments.instruments.spectrum_analyzers import Tek5103
+        >>> rsa = Tek5103(SocketResource('192.168.1.20'))
+    """
+
+    def __init__(self, host, port=5025, timeout=10000., read_termination='\n',
+            write_termination='\n', buffer_size=4*1024*1024,
+            encoding='ascii'):
+        _BufferedResource.__init__(self, read_termination, write_termination,
+            encoding)
+        self.host = host
+        self.port = port
+        self.resource_name = 'TCPIP::{}::{}::SOCKET'.format(host, port)
+        self._sock = socket.create_connection((host, port), timeout/1000.)
+        for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self._sock.setsockopt(socket.SOL_SOCKET, opt, buffer_size)
+            except (OSError, socket.error):
+                pass
+        # Commands are small and latency matters more than packet count
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timeout = timeout
+
+    def __repr__(self):
+        return 'SocketResource({!r}, {!r})'.format(self.host, self.port)
+
+    @property
+    def timeout(self):
+        """timeout in ms"""
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self._sock.settimeout(None if value is None else value/1000.)
+
+    def close(self):
+        """Close the connection."""
+        self._sock.close()
+
+    def _send(self, data):
+        self._sock.sendall(data)
+
+    def _recv_into(self, view):
+        n = self._sock.recv_into(view)
+        if n == 0:
+            raise IOError('connection to {} closed'.format(self.resource_name))
+        return n
+
+class SerialResource(_BufferedResource):
+    """
+    Initialize SerialResource class object
+
+    SCPI over a serial port (RS-232 or USB serial adapter) with the pyVisa
+    Resource interface, so the drivers work with pySerial.  Reads are
+    buffered: whatever the port has waiting is read in one call and searched
+    for the termination character, and binary blocks are read into a numpy
+    array in one call.  pySerial is only imported when a port is opened by
+    name.
+
+    Args:
+        port (str or object) : port name ('COM3', '/dev/ttyUSB0') or any
+            pySerial URL ('loop://', 'socket://host:port'), or a port object
+            that is already open, e.g. a serial.Serial
+        baudrate (int, optional) : baud rate.  Default 9600.
+        timeout (float, optional) : timeout in ms, as in pyVisa.  Default
+            10000.
+        read_termination (str, optional) : end of a text response.  Default
+            newline.
+        write_termination (str, optional) : appended to written commands.
+            Default newline.
+        encoding (str, optional) : text encoding.  Default ascii.
+        **kwargs : other settings passed to serial.serial_for_url, e.g.
+            parity, stopbits, rtscts
+
+    Examples:
+        >>> from wanglab_instruments.instruments.transports import SerialResource
+        >>> from wanglab_instruments.instruments.lockins import SR844
+        >>> lockin = SR844(SerialResource('/dev/ttyUSB0', 19200,
+        ...                               read_termination='\\r'))
+    """
+
+    def __init__(self, port, baudrate=9600, timeout=10000.,
+            read_termination='\n', write_termination='\n', encoding='ascii',
+            **kwargs):
+        _BufferedResource.__init__(self, read_termination, write_termination,
+            encoding)
+        if isinstance(port, str):
+            import serial
+            port = serial.serial_for_url(port, baudrate=baudrate, **kwargs)
+        self.port = port
+        self.resource_name = getattr(port, 'name', None) or repr(port)
+        self.timeout = timeout
+
+    def __repr__(self):
+        return 'SerialResource({!r})'.format(self.resource_name)
+
+    @property
+    def timeout(self):
+        """timeout in ms"""
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self.port.timeout = None if value is None else value/1000.
+
+    def close(self):
+        """Close the port."""
+        self.port.close()
+
+    def _send(self, data):
+        self.port.write(data)
+        self.port.flush()
+
+    def _recv_into(self, view):
+        # Take everything that has arrived, or wait for at least one byte.
+        # Asking for more than is waiting would block until the timeout.
+        waiting = getattr(self.port, 'in_waiting', 0)
+        n = self.port.readinto(view[:max(1, min(waiting, len(view)))])
+        if not n:
+            raise IOError('timeout reading from {}'.format(self.resource_name))
+        return n
+
+    def read_into(self, view):
+        # The length of a block is known, so one readinto call that waits for
+        # all of it is cheaper than a call per arrival
+        view = memoryview(view).cast('B')
+        pos = min(len(self._buf), len(view))
+        view[:pos] = self._buf[:pos]
+        del self._buf[:pos]
+        if pos < len(view):
+            n = self.port.readinto(view[pos:])
+            if pos + n < len(view):
+                raise IOError('timeout reading from {}'.format(
+                    self.resource_name))
+        return len(view)
+    read_into.__doc__ = _BufferedResource.read_into.__doc__
+
+    def clear(self):
+        """Discard unread input."""
+        self._buf = bytearray()
+        self.port.reset_input_buffer()
+
+if __name__ == '__main__':
+    # Stand-in instrument: answers *IDN? and TRACE? on a local port
+    import threading
+    import time
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+    trace = np.arange(1000000, dtype='<f4')
+    def serve():
+        conn, addr = server.accept()
+        f = conn.makefile('rb')
+        for line in f:
+            line = line.strip()
+            if line == b'*IDN?':
+                conn.sendall(b'STAND-IN,0,0,0\n')
+            elif line == b'TRACE?':
+                data = trace.tobytes()
+                n = str(len(data)).encode()
+                conn.sendall(b'#' + str(len(n)).encode() + n + data + b'\n')
+        conn.close()
+    threading.Thread(target=serve).start()
+    with SocketResource('127.0.0.1', port) as inst:
+        print(inst.query('*IDN?'))
+        print(inst.query_pipelined(['*IDN?']*3))
+        buf = np.empty(len(trace), dtype='<f4')
+        t0 = time.time()
+        for i in range(10):
+            y = inst.query_binary_values('TRACE?', container=np.array, out=buf)
+        dt = (time.time() - t0)/10
+        print('{:.0f} MB/s, data ok: {}'.format(trace.nbytes/dt/1e6,
+            np.array_equal(y, trace)))
+    server.close()
+    try:
+        import serial
+    except ImportError:
+        serial = None
+    if serial is not None:
+        # A loopback port echoes what is written, standing in for a device
+        with SerialResource('loop://', timeout=1000) as inst:
+            print(inst.query('*IDN?'))
+            inst.write_binary_values('', trace[:1000])
+            print(np.array_equal(inst.read_binary_block(), trace[:1000]))
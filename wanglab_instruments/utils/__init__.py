@@ -0,0 +1,16 @@
+# Submodules are imported on first use, see instruments/__init__.py
+import importlib
+
+_submodules = ('helpers', 'export_data', 'decimate', 'batch_fit', 'scan',
+               'checkpoint', 'job_status_print', 'averager', 'profiling')
+
+def __getattr__(name):
+    if name in _submodules:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
@@ -0,0 +1,171 @@
+from __future__ import print_function
+import numpy as np
+from .helpers import unlog, log
+from ..instruments.trace import Trace, resolve_dtype
+
+###################### Streaming averages ###############################
+
+class Averager(object):
+    """
+    Initialize Averager class object
+
+    Running mean and variance of repeated traces (Welford's algorithm),
+    updated in place so memory stays the same however many traces are added.
+    Traces in dB (e.g. spectrum analyzer traces) can be averaged in the
+    linear domain, the way the analyzers average power.
+
+    Args:
+        db (bool, optional) : True if the traces are in dB.  They are
+            converted with helpers.unlog before averaging, and mean is
+            reported in dB.
+        dtype (optional) : accumulator dtype, np.float64 or np.float32 to
+            halve the memory of long traces.  Default is the package-wide
+            dtype, see instruments.trace.set_default_dtype.
+
+    Examples:
+        >>> avg = Averager(db=True)
+        >>> for i in range(1000):
+        ...     avg.add(rsa.fetch_spectrum(1))
+        >>> x, y = avg.result()
+        >>> err = avg.sem
+    """
+
+    def __init__(self, db=False, dtype=None):
+        self.db = db
+        self.dtype = resolve_dtype(dtype)
+        self.reset()
+
+    def __repr__(self):
+        return 'Averager(db={!r}, dtype={!r}, count={})'.format(self.db,
+            self.dtype.name, self.count)
+
+    def reset(self):
+        """Discard everything averaged so far."""
+        self.count = 0
+        self.x = None
+        self._mean = None
+        self._m2 = None
+        self._delta = None
+
+    def add(self, data):
+        """
+        add(self, data)
+
+        Add one trace.
+
+        Args:
+            data : y array, or a Trace or (x, y) tuple as returned by the
+                drivers' fetch methods.  The x axis of the first trace is
+                kept.
+        """
+        if isinstance(data, Trace):
+            # Only ask for x once, a uniform axis is built on every access
+            y = data.y
+            if self.x is None:
+                self.x = data.x
+        elif isinstance(data, tuple):
+            x, y = data
+            if self.x is None:
+                self.x = x
+        else:
+            y = data
+        y = np.asarray(y)
+        if self.db:
+            y = unlog(y)
+        if self._mean is None:
+            self._mean = np.zeros(y.shape, dtype=self.dtype)
+            self._m2 = np.zeros(y.shape, dtype=self.dtype)
+            self._delta = np.empty(y.shape, dtype=self.dtype)
+        elif y.shape != self._mean.shape:
+            raise ValueError('Trace of shape {} does not match {}'.format(
+                y.shape, self._mean.shape))
+        self.count += 1
+        n = self.count
+        d = self._delta
+        # d = (y - mean)/n, then mean += d and m2 += (y - mean)(y - new mean),
+        # which is n(n-1)d**2, all without temporary arrays
+        np.subtract(y, self._mean, out=d)
+        d *= 1./n
+        self._mean += d
+        np.multiply(d, d, out=d)
+        d *= n*(n - 1.)
+        self._m2 += d
+
+    def _check(self):
+        if self._mean is None:
+            raise ValueError('No traces averaged yet')
+
+    @property
+    def mean(self):
+        """mean of the traces, in dB if db is True"""
+        self._check()
+        if self.db:
+            return log(self._mean)
+        return self._mean.copy()
+
+    @property
+    def variance(self):
+        """sample variance of the traces (linear units if db is True)"""
+        self._check()
+        if self.count < 2:
+            return np.full(self._mean.shape, np.nan, dtype=self.dtype)
+        return self._m2/(self.count - 1)
+
+    @property
+    def std(self):
+        """sample standard deviation (linear units if db is True)"""
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """standard error of mean, in dB if db is True"""
+        sem = np.sqrt(self.variance/self.count)
+        if self.db:
+            # Propagated through 10 log10(mean)
+            return 10/np.log(10)*sem/self._mean
+        return sem
+
+    def result(self):
+        """
+        result(self)
+
+        Returns:
+            tuple : x axis of the first trace (None if only y arrays were
+                added), mean
+        """
+        return self.x, self.mean
+
+def average(fetch, repetitions, db=False, dtype=None, callback=None):
+    """
+    average(fetch, repetitions, db=False, dtype=None, callback=None)
+
+    Average repeated traces from a fetch function, see Averager.
+
+    Args:
+        fetch (callable) : called with no arguments for every trace, e.g.
+            lambda: scope.fetch_spectrum(1)
+        repetitions (int) : number of traces to average
+        db (bool, optional) : True if the traces are in dB
+        dtype (optional) : accumulator dtype
+        callback (callable, optional) : called as callback(averager) after
+            every trace.  Averaging stops early when it returns True, e.g.
+            once sem is small enough.
+
+    Returns:
+        Averager : the averages
+    """
+    avg = Averager(db, dtype)
+    for i in range(repetitions):
+        avg.add(fetch())
+        if callback is not None and callback(avg):
+            break
+    return avg
+
+if __name__ == '__main__':
+    x = np.linspace(-1, 1, 1001)
+    def fetch():
+        return x, -60 + 30/(1 + (x/.1)**2) + np.random.normal(0, 1, len(x))
+    avg = average(fetch, 500, db=True)
+    print(avg)
+    print('mean at center {:.2f} dB, sem {:.3f} dB'.format(
+        avg.mean[500], avg.sem[500]))
@@ -0,0 +1,256 @@
+import numpy as np
+import multiprocessing
+from . import helpers
+
+###################### Batch Fitting ###############################
+
+# Status codes returned for every trace by fit_stack
+FIT_OK = 0
+FIT_NO_CONVERGENCE = 1
+FIT_ERROR = 2
+
+# Keyword names of the initial guesses taken by the fit helpers, in the order
+# of the returned popt.  Used to warm start a fit from the previous result.
+FIT_PARAMETERS = {
+    helpers.fit_lorentzian: ('x0', 'y0', 'amp', 'fwhm'),
+    helpers.fit_lorentzian_triplet: ('x0', 'y0', 'amp', 'fwhm',
+                                     'xl', 'ampl', 'fwhml',
+                                     'xr', 'ampr', 'fwhmr'),
+    }
+
+def _fit_chunk(args):
+    """
+    _fit_chunk(args)
+
+    Fit consecutive traces of a chunk.  Runs in a worker process, so it must
+    live at module level and only take picklable arguments.
+
+    Args:
+        args : tuple
+            (fit, x_data, y_chunk, warm_start, names, kwargs)
+
+    Returns:
+        list : (popt, pcov, status) for every trace in the chunk
+    """
+    fit, x_data, y_chunk, warm_start, names, kwargs = args
+    results = []
+    guess = {}
+    for y_data in y_chunk:
+        try:
+            fit_kwargs = dict(kwargs)
+            fit_kwargs.update(guess)
+            popt, pcov = fit(x_data, y_data, **fit_kwargs)
+            results.append((popt, pcov, FIT_OK))
+            if warm_start:
+                guess = dict(zip(names, popt))
+        except RuntimeError:
+            # curve_fit did not converge within maxfev
+            results.append((None, None, FIT_NO_CONVERGENCE))
+            guess = {}
+        except (ValueError, IndexError, np.linalg.LinAlgError):
+            # bad data or initial guesses that could not be built
+            results.append((None, None, FIT_ERROR))
+            guess = {}
+    return results
+
+def _map_chunks(worker, y_stack, processes, make_job):
+    """
+    _map_chunks(worker, y_stack, processes, make_job)
+
+    Split y_stack into one contiguous chunk per process, run worker on
+    make_job(chunk) for every chunk and return the concatenated results.
+    """
+    n = len(y_stack)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, n))
+    edges = np.linspace(0, n, processes + 1).astype(int)
+    jobs = [make_job(y_stack[lo:hi])
+            for lo, hi in zip(edges[:-1], edges[1:])]
+    if processes == 1:
+        chunks = [worker(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunks = pool.map(worker, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return [r for chunk in chunks for r in chunk]
+
+def fit_stack(fit, x_data, y_stack, processes=None, warm_start=False,
+        param_names=None, **kwargs):
+    """
+    fit_stack(fit, x_data, y_stack, processes=None, warm_start=False,
+        param_names=None, **kwargs)
+
+    Fit every row of a 2D stack of traces sharing one x axis, spread across a
+    process pool.  Failed fits do not raise, they are reported in status and
+    their parameters are filled with nan.
+
+    The stack is split into one contiguous chunk per process.  With
+    warm_start, each fit inside a chunk starts from the parameters of the
+    previous (successful) fit, which speeds up convergence for slowly
+    changing traces, e.g. one trace per sweep point.
+
+    Args:
+        fit : callable
+            fit helper with signature fit(x_data, y_data, **kwargs) returning
+            (popt, pcov), e.g. helpers.fit_lorentzian or
+            helpers.fit_lorentzian_triplet.  Must be defined at module level
+            so it can be sent to the worker processes.
+        x_data : array
+            x axis shared by all traces
+        y_stack : 2D array
+            one trace per row
+        processes : int, optional
+            number of worker processes.  Defaults to the number of CPUs.  1
+            fits in the calling process without starting a pool.
+        warm_start : bool, optional
+            start each fit from the previous fit's parameters
+        param_names : sequence of str, optional
+            keyword names of fit's initial guesses in popt order.  Needed for
+            warm_start when fit is not listed in FIT_PARAMETERS.
+        **kwargs :
+            passed on to fit for every trace
+
+    Returns:
+        tuple : popt (n_traces, n_params), pcov (n_traces, n_params,
+            n_params), status (n_traces,) with values FIT_OK,
+            FIT_NO_CONVERGENCE or FIT_ERROR
+    """
+    y_stack = np.atleast_2d(y_stack)
+    n = len(y_stack)
+    if param_names is None:
+        # A profiled fit helper is looked up as the original, see profiling
+        param_names = FIT_PARAMETERS.get(getattr(fit, '__wrapped__', fit), ())
+    if warm_start and not param_names:
+        raise ValueError('param_names required to warm start {}'.format(
+            getattr(fit, '__name__', fit)))
+    results = _map_chunks(_fit_chunk, y_stack, processes,
+        lambda y_chunk: (fit, x_data, y_chunk, warm_start, param_names,
+                         kwargs))
+    status = np.array([r[2] for r in results], dtype=int)
+    n_params = len(param_names)
+    for popt_i, pcov_i, status_i in results:
+        if status_i == FIT_OK:
+            n_params = len(popt_i)
+            break
+    popt = np.full((n, n_params), np.nan)
+    pcov = np.full((n, n_params, n_params), np.nan)
+    for i, (popt_i, pcov_i, status_i) in enumerate(results):
+        if status_i == FIT_OK:
+            popt[i] = popt_i
+            pcov[i] = pcov_i
+    return popt, pcov, status
+
+###################### Linewidth Pipeline ###############################
+
+def _linewidth_chunk(args):
+    """
+    _linewidth_chunk(args)
+
+    Calibration and linewidth fits for consecutive transmission traces.
+    Runs in a worker process.
+
+    Args:
+        args : tuple
+            (x, y_chunk, invert)
+
+    Returns:
+        list : (x0, xl, xr, popt, status) for every trace, where popt is the
+            lorentzian fit of the central peak in uncalibrated units
+    """
+    x, y_chunk, invert = args
+    sign = -1. if invert else 1.
+    results = []
+    for y in y_chunk:
+        y = sign*y
+        try:
+            p3, _ = helpers.fit_lorentzian_triplet(x, y)
+            x0, xl, xr = p3[0], p3[4], p3[7]
+            # The carrier of the triplet fit is an excellent starting point
+            # for the single lorentzian fit
+            popt, _ = helpers.fit_lorentzian(x, y, *p3[:4])
+            results.append((x0, xl, xr, popt, FIT_OK))
+        except RuntimeError:
+            results.append((np.nan, np.nan, np.nan, None, FIT_NO_CONVERGENCE))
+        except (ValueError, IndexError, np.linalg.LinAlgError):
+            results.append((np.nan, np.nan, np.nan, None, FIT_ERROR))
+    return results
+
+def linewidth_stack(x, y_stack, eom_frequency, baseline=None, invert=True,
+        processes=None):
+    """
+    linewidth_stack(x, y_stack, eom_frequency, baseline=None, invert=True,
+        processes=None)
+
+    Calibrated frequency axes, normalized transmission dips and linewidths for
+    a stack of traces, the batch equivalent of helpers.calibrate_x,
+    helpers.normalize_transmission_dip and helpers.get_linewidth.
+
+    Each trace costs two fits, run in parallel across a process pool: a
+    lorentzian_triplet fit to calibrate the axis with the EOM sidebands, and a
+    single lorentzian fit of the central peak started from the triplet's
+    carrier.  The calibrated axis is an affine function of x, so the single
+    fit is done in uncalibrated units and its width and offset serve both the
+    linewidth and the normalization.  Building the calibrated axes and
+    normalized dips is then a single broadcast over the whole stack.
+
+    Args:
+        x : array
+            x axis shared by all traces (e.g. laser detuning in volts)
+        y_stack : 2D array
+            one transmission trace per row
+        eom_frequency : float
+            EOM modulation frequency, the sideband spacing in calibrated units
+        baseline : array, optional
+            off-resonance transmission level.  1D to share one baseline
+            across the stack, or 2D with one baseline per trace.  Normalized
+            dips are only computed if a baseline is given.
+        invert : bool, optional
+            True if the mode appears as a dip.  Default is True.
+        processes : int, optional
+            number of worker processes, see fit_stack
+
+    Returns:
+        tuple : xcal (n_traces, len(x)), ynorm (n_traces, len(x)) or None,
+            linewidth (n_traces,), status (n_traces,).  Rows of failed fits
+            are nan.
+    """
+    x = np.asarray(x, dtype=float)
+    y_stack = np.atleast_2d(y_stack)
+    results = _map_chunks(_linewidth_chunk, y_stack, processes,
+        lambda y_chunk: (x, y_chunk, invert))
+    n = len(y_stack)
+    status = np.array([r[4] for r in results], dtype=int)
+    x0 = np.array([r[0] for r in results])
+    scale = 2*eom_frequency/(np.array([r[2] for r in results])
+                             - np.array([r[1] for r in results]))
+    popt = np.full((n, 4), np.nan)
+    for i, r in enumerate(results):
+        if r[4] == FIT_OK:
+            popt[i] = r[3]
+    xcal = (x[np.newaxis, :] - x0[:, np.newaxis])*scale[:, np.newaxis]
+    linewidth = np.abs(popt[:, 3]*scale)
+    ynorm = None
+    if baseline is not None:
+        sign = -1. if invert else 1.
+        ymax = sign*popt[:, 1]
+        ymin = np.mean(baseline, axis=-1)
+        ynorm = (-(y_stack - ymax[:, np.newaxis])
+                 /np.reshape(ymax - ymin, (-1, 1)))
+    return xcal, ynorm, linewidth, status
+
+if __name__ == '__main__':
+    import time
+    x = np.linspace(-2, 2, 500)
+    centers = np.linspace(-.5, .5, 200)
+    y = np.array([helpers.lorentzian(x, c, 0, 1, .1) for c in centers])
+    y += np.random.normal(0, .01, y.shape)
+    for warm_start in (False, True):
+        t0 = time.time()
+        popt, pcov, status = fit_stack(helpers.fit_lorentzian, x, y,
+            warm_start=warm_start)
+        print('warm_start={}: {} fits in {:.2f} s, {} failed'.format(
+            warm_start, len(y), time.time() - t0, np.sum(status != FIT_OK)))
@@ -0,0 +1,177 @@
+import os
+import json
+import numpy as np
+
+###################### Checkpoints ###############################
+
+def snapshot_of(inst):
+    """
+    snapshot_of(inst)
+
+    Snapshot of an instrument for the checkpoint record, if its driver has a
+    snapshot method that can be called without arguments, else its repr.
+    """
+    snapshot = getattr(inst, 'snapshot', None)
+    if snapshot is not None:
+        try:
+            return snapshot()
+        except TypeError:
+            pass
+    return repr(inst)
+
+class Checkpoint(object):
+    """
+    Initialize Checkpoint class object
+
+    Incremental on-disk progress record for long acquisitions, so a sweep
+    interrupted by a GPIB timeout or a kernel crash can resume from the last
+    completed point.  A checkpoint is a directory holding:
+
+        progress.json : number of completed points, metadata and instrument
+            snapshots, rewritten atomically after every point
+        <name>.npy : one memory-mapped array per data set, so saving a point
+            only writes that point's data
+
+    Args:
+        path (str) : checkpoint directory, created if it doesn't exist
+
+    Examples:
+        >>> cp = Checkpoint('overnight_scan')
+        >>> data = cp.array('y', (1000, 4096))
+        >>> for i in range(cp.completed, 1000):
+        ...     data[i] = rsa.read_spectrum(1)[1]
+        ...     cp.commit(i + 1)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._arrays = {}
+        self.progress = {'completed': 0, 'finished': False, 'meta': {},
+                         'states': []}
+        progress_file = os.path.join(path, 'progress.json')
+        if os.path.exists(progress_file):
+            with open(progress_file) as f:
+                self.progress.update(json.load(f))
+
+    def __repr__(self):
+        return 'Checkpoint({!r})'.format(self.path)
+
+    @property
+    def completed(self):
+        """number of points completed so far"""
+        return self.progress['completed']
+
+    @property
+    def finished(self):
+        """True once the acquisition ran to the end"""
+        return self.progress['finished']
+
+    @property
+    def meta(self):
+        """dict of metadata describing the acquisition"""
+        return self.progress['meta']
+
+    def start(self, meta, states=()):
+        """
+        start(self, meta, states=())
+
+        Begin or resume an acquisition.  On a fresh checkpoint meta and states
+        are recorded.  When resuming, meta must match what was recorded, so a
+        checkpoint is never resumed with different scan parameters.
+
+        Args:
+            meta (dict) : JSON serializable description of the acquisition
+            states (sequence, optional) : instrument snapshots to record
+
+        Returns:
+            int : number of points already completed
+        """
+        meta = json.loads(json.dumps(meta))
+        if self.completed == 0:
+            self.progress['meta'] = meta
+            self.progress['states'] = list(states)
+            self._write_progress()
+        elif meta != self.meta:
+            raise ValueError('Checkpoint {} was made for {}, not {}'.format(
+                self.path, self.meta, meta))
+        return self.completed
+
+    def array(self, name, shape=None, dtype=float):
+        """
+        array(self, name, shape=None, dtype=float)
+
+        Memory-mapped data array stored in the checkpoint.  An existing array
+        is reopened with its data when resuming, otherwise a new one is
+        created and filled with nan (zeros for integer types).
+
+        Args:
+            name (str) : name of the data set
+            shape (tuple of int, optional) : shape of the array.  May only be
+                omitted to reopen an existing array when resuming.
+            dtype (optional) : numpy dtype.  Default is float64.  Ignored
+                when shape is omitted.
+
+        Returns:
+            numpy.memmap : the array
+        """
+        if name in self._arrays:
+            return self._arrays[name]
+        filename = os.path.join(self.path, name + '.npy')
+        arr = None
+        if os.path.exists(filename) and self.completed:
+            arr = np.lib.format.open_memmap(filename, mode='r+')
+            if shape is None:
+                shape, dtype = arr.shape, arr.dtype
+            if arr.shape != tuple(shape) or arr.dtype != np.dtype(dtype):
+                raise ValueError('{} holds {} {}, expected {} {}'.format(
+                    filename, arr.shape, arr.dtype, shape, np.dtype(dtype)))
+        if arr is None:
+            if shape is None:
+                raise ValueError('No data set {} to resume in {}'.format(
+                    name, self.path))
+            arr = np.lib.format.open_memmap(filename, mode='w+',
+                dtype=dtype, shape=shape)
+            if np.issubdtype(arr.dtype, np.inexact):
+                arr[...] = np.nan
+        self._arrays[name] = arr
+        return arr
+
+    def has_array(self, name):
+        """True if the data set exists on disk or is open"""
+        return (name in self._arrays
+                or os.path.exists(os.path.join(self.path, name + '.npy')))
+
+    def commit(self, completed, state=None):
+        """
+        commit(self, completed, state=None)
+
+        Record that the first completed points are done.  Array data is
+        flushed to disk before the progress file is updated, so the progress
+        never claims data that wasn't written.
+
+        Args:
+            completed (int) : number of points completed
+            state (optional) : JSON serializable instrument state to append to
+                the record, e.g. a snapshot taken at this point
+        """
+        for arr in self._arrays.values():
+            arr.flush()
+        self.progress['completed'] = int(completed)
+        if state is not None:
+            self.progress['states'].append(state)
+        self._write_progress()
+
+    def finish(self):
+        """Mark the acquisition as complete."""
+        self.progress['finished'] = True
+        self.commit(self.completed)
+
+    def _write_progress(self):
+        filename = os.path.join(self.path, 'progress.json')
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.progress, f, separators=(',', ':'))
+        # os.replace is atomic, a crash leaves either the old or new progress
+        os.replace(tmp, filename)
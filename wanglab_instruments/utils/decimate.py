@@ -0,0 +1,152 @@
+import numpy as np
+
+###################### Decimation for plotting ###############################
+
+def _bucket_bounds(n, n_buckets):
+    """
+    _bucket_bounds(n, n_buckets)
+
+    Split range(n) into n_buckets contiguous buckets of (nearly) equal size.
+
+    Returns:
+        array : n_buckets+1 bucket edges, edges[0] = 0 and edges[-1] = n
+    """
+    return np.linspace(0, n, n_buckets + 1).astype(np.intp)
+
+def minmax_indices(y, n_out):
+    """
+    minmax_indices(y, n_out)
+
+    Indices of the min/max envelope of y reduced to about n_out points.  Each
+    bucket contributes its minimum and its maximum, in the order they occur,
+    so narrow peaks (spurs) always survive the decimation.
+
+    Args:
+        y : array
+            data to decimate
+        n_out : int
+            approximate number of points to keep.  Two points are kept per
+            bucket, so n_out//2 buckets are used.
+
+    Returns:
+        array : sorted indices into y
+    """
+    y = np.asarray(y)
+    n = len(y)
+    n_buckets = max(n_out//2, 1)
+    if n <= n_out or n_buckets >= n:
+        return np.arange(n)
+    size = n//n_buckets
+    full = size*n_buckets
+    # Equal size buckets can be handled with a single reshape.  Points left
+    # over at the end go into the last bucket.
+    blocks = y[:full].reshape(n_buckets, size)
+    offsets = np.arange(n_buckets)*size
+    imin = np.argmin(blocks, axis=1) + offsets
+    imax = np.argmax(blocks, axis=1) + offsets
+    if full < n:
+        tail = y[full - size:]
+        imin[-1] = full - size + np.argmin(tail)
+        imax[-1] = full - size + np.argmax(tail)
+    idx = np.empty(2*n_buckets, dtype=np.intp)
+    idx[0::2] = np.minimum(imin, imax)
+    idx[1::2] = np.maximum(imin, imax)
+    idx = np.concatenate(([0], idx, [n - 1]))
+    return np.unique(idx)
+
+def lttb_indices(x, y, n_out):
+    """
+    lttb_indices(x, y, n_out)
+
+    Indices chosen by the Largest-Triangle-Three-Buckets algorithm.  The first
+    and last points are always kept.  For every bucket in between, the point
+    forming the largest triangle with the previously selected point and the
+    average of the next bucket is kept.
+
+    Args:
+        x : array
+            x-axis values
+        y : array
+            y-axis values
+        n_out : int
+            number of points to keep (at least 3)
+
+    Returns:
+        array : sorted indices into x and y
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    # Interior points are split into n_out-2 buckets
+    edges = _bucket_bounds(n - 2, n_out - 2) + 1
+    # Bucket averages are independent of the selection, compute all at once
+    counts = np.diff(edges)
+    x_avg = np.add.reduceat(x[1:-1], edges[:-1] - 1)/counts
+    y_avg = np.add.reduceat(y[1:-1], edges[:-1] - 1)/counts
+    x_avg = np.append(x_avg, x[-1])
+    y_avg = np.append(y_avg, y[-1])
+    idx = np.empty(n_out, dtype=np.intp)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        xb = x[lo:hi]
+        yb = y[lo:hi]
+        # Twice the triangle area, the factor of 2 doesn't change the argmax
+        area = np.abs((x[a] - x_avg[i + 1])*(yb - y[a])
+                      - (x[a] - xb)*(y_avg[i + 1] - y[a]))
+        a = lo + np.argmax(area)
+        idx[i + 1] = a
+    return idx
+
+def decimate(x, y, n_out=1000, method='minmax'):
+    """
+    decimate(x, y, n_out=1000, method='minmax')
+
+    Reduce a trace to about n_out points for plotting.  Traces already
+    shorter than n_out are returned unchanged.
+
+    Args:
+        x : array
+            x-axis values
+        y : array
+            y-axis values
+        n_out : int, optional
+            target number of points.  Default is 1000, roughly twice the pixel
+            width of the figures made by export_data.save_xy.
+        method : str, optional
+            'minmax' keeps the min and max of every bucket (peaks are
+            preserved exactly).  'lttb' uses Largest-Triangle-Three-Buckets,
+            which better preserves the visual shape of smooth data.
+
+    Returns:
+        tuple : numpy arrays of the decimated x and y
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if method == 'minmax':
+        idx = minmax_indices(y, n_out)
+    elif method == 'lttb':
+        idx = lttb_indices(x, y, n_out)
+    else:
+        raise ValueError('method = { minmax | lttb }')
+    return x[idx], y[idx]
+
+if __name__ == '__main__':
+    import time
+    x = np.linspace(0, 1, 250000)
+    y = np.random.normal(0, 1, len(x))
+    y[123457] = 50
+    t0 = time.time()
+    xd, yd = decimate(x, y)
+    t1 = time.time()
+    print('minmax: {} -> {} points in {:.2f} ms, max kept: {}'.format(
+        len(y), len(yd), 1000*(t1 - t0), np.max(yd) == 50))
+    t0 = time.time()
+    xd, yd = decimate(x, y, method='lttb')
+    t1 = time.time()
+    print('lttb: {} -> {} points in {:.2f} ms, max kept: {}'.format(
+        len(y), len(yd), 1000*(t1 - t0), np.max(yd) == 50))
@@ -1,13 +1,22 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from helpers import timestamp
+from .helpers import timestamp
+from .decimate import decimate
 
-def save_xy(x_data, y_data, save_to = '', time_stamp = True, plot = True):
+def plot_points(fig):
+	# Number of points worth plotting: two (min and max) per horizontal pixel
+	# of the saved figure.
+	return 2*int(fig.get_figwidth()*fig.dpi)
+
+def save_xy(x_data, y_data, save_to = '', time_stamp = True, plot = True,
+	decimation = 'minmax'):
 
 	# x_data: numpy array of x-axis
 	# y_data: either numpy array of single y-data, or list of multiple numpy
 	# arrays of y-data
 	# When save_to is empty, saved data will be named by the time_stamp. 
+	# decimation: method used to reduce long traces before plotting
+	# ('minmax' or 'lttb', see utils.decimate).  None plots every point.
+	# The saved data is never decimated.
 
 	if save_to == '' and not time_stamp:
 		message = (' save_xy(x_data, y_data, save_to = \'\', '
@@ -16,11 +25,19 @@ def save_xy(x_data, y_data, save_to = '', time_stamp = True, plot = True):
 			+ 'Empty save_to and time_stamp = False.  Nothing to name file.')
 		raise Exception(message)
 
+	if plot:
+		# matplotlib is slow to import, only pay for it when plotting
+		import matplotlib.pyplot as plt
+
 	if type(y_data).__name__ == 'list':	
 		if plot:
-			fig, ax = plt.subplots(1, figsize = (5, 5) )
+			fig, ax = plt.subplots(1, figsize = (5, 5), dpi = 100)
 			for i in range(len(y_data)):
-				ax.plot(x_data, y_data[i])
+				if decimation is None:
+					ax.plot(x_data, y_data[i])
+				else:
+					ax.plot(*decimate(x_data, y_data[i], plot_points(fig),
+						decimation))
 			fig.tight_layout()
 			if time_stamp:
 				fig.savefig(save_to + timestamp() + '.png', dpi = 100)
@@ -32,8 +49,12 @@ def save_xy(x_data, y_data, save_to = '', time_stamp = True, plot = True):
 
 	elif type(y_data).__name__ == 'ndarray':
 		if plot:
-			fig, ax = plt.subplots(1, figsize = (5, 5) )
-			ax.plot(x_data, y_data)
+			fig, ax = plt.subplots(1, figsize = (5, 5), dpi = 100)
+			if decimation is None:
+				ax.plot(x_data, y_data)
+			else:
+				ax.plot(*decimate(x_data, y_data, plot_points(fig),
+					decimation))
 			fig.tight_layout()
 			if time_stamp:
 				fig.savefig(save_to + timestamp() + '.png', dpi = 100)
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.optimize import curve_fit
 import datetime
 
 ###################### Timestamp ###############################
@@ -108,10 +107,239 @@ def K():
     '''
     pass
 
+###################### Jacobians ###############################
+# Closed form derivatives of the functional forms with respect to their
+# parameters, in the shape expected by curve_fit's jac argument:
+# (len(x), number of parameters).  Passing these to curve_fit saves one model
+# evaluation per parameter per iteration over finite differences.
+
+def _lorentzian_partials(x,x0,amp,fwhm):
+    # derivatives of 0.25*amp*fwhm**2/((x-x0)**2 + 0.25*fwhm**2) with respect
+    # to x0, amp and fwhm
+    dx = x - x0
+    hw2 = 0.25*fwhm**2
+    inv_den = 1./(dx**2 + hw2)
+    shape = hw2*inv_den
+    d_x0 = 2*amp*shape*dx*inv_den
+    d_amp = shape
+    d_fwhm = 0.5*amp*fwhm*dx**2*inv_den**2
+    return d_x0, d_amp, d_fwhm
+
+def lorentzian_jac(x,x0=0,y0=0,amp=1,fwhm=1):
+    """
+    lorentzian_jac(x,x0=0,y0=0,amp=1,fwhm=1)
+
+    Jacobian of lorentzian with respect to (x0, y0, amp, fwhm).
+
+    Returns:
+        array : shape (len(x), 4)
+    """
+    x = np.asarray(x, dtype=float)
+    jac = np.empty((x.size, 4))
+    jac[:,0], jac[:,2], jac[:,3] = _lorentzian_partials(x,x0,amp,fwhm)
+    jac[:,1] = 1.
+    return jac
+
+def lorentzian_triplet_jac(x,x0=0,y0=0,amp=1,fwhm=.2,
+                        xl=-1,ampl=1,fwhml=.2,
+                        xr=1,ampr=1,fwhmr=.2):
+    """
+    lorentzian_triplet_jac(x,x0=0,y0=0,amp=1,fwhm=.2,xl=-1,ampl=1,fwhml=.2,
+        xr=1,ampr=1,fwhmr=.2)
+
+    Jacobian of lorentzian_triplet with respect to its 10 parameters, in the
+    order of the lorentzian_triplet signature.
+
+    Returns:
+        array : shape (len(x), 10)
+    """
+    x = np.asarray(x, dtype=float)
+    jac = np.empty((x.size, 10))
+    jac[:,0], jac[:,2], jac[:,3] = _lorentzian_partials(x,x0,amp,fwhm)
+    jac[:,1] = 1.
+    jac[:,4], jac[:,5], jac[:,6] = _lorentzian_partials(x,xl,ampl,fwhml)
+    jac[:,7], jac[:,8], jac[:,9] = _lorentzian_partials(x,xr,ampr,fwhmr)
+    return jac
+
+def exp_decay_jac(x,x0=0,y0=0,amp=1,gamma=1):
+    """
+    exp_decay_jac(x,x0=0,y0=0,amp=1,gamma=1)
+
+    Jacobian of exp_decay with respect to (x0, y0, amp, gamma).  The delta
+    function from differentiating the step at x0 is dropped.
+
+    Returns:
+        array : shape (len(x), 4)
+    """
+    x = np.asarray(x, dtype=float)
+    dx = x - x0
+    decay = h(dx)*np.exp(-dx*gamma)
+    jac = np.empty((x.size, 4))
+    jac[:,0] = amp*gamma*decay
+    jac[:,1] = 1.
+    jac[:,2] = decay
+    jac[:,3] = -amp*dx*decay
+    return jac
+
+def optical_doublet_fit_jac(d,d0,off,amp,k0,kex,gamma):
+    """
+    optical_doublet_fit_jac(d,d0,off,amp,k0,kex,gamma)
+
+    Jacobian of optical_doublet_fit with respect to
+    (d0, off, amp, k0, kex, gamma).
+
+    Returns:
+        array : shape (len(d), 6)
+    """
+    d = np.asarray(d, dtype=float)
+    a = 0.5*(k0 + kex) - 1.j*(d - d0)
+    den = a + 0.25*gamma**2/a
+    r = 1 - kex/den
+    # dr/dp = kex/den**2 * dden/dp, and additionally -1/den for kex
+    c = kex/den**2
+    dden_da = 1 - 0.25*gamma**2/a**2
+    dr_dd0 = c*dden_da*1.j
+    dr_dk0 = c*dden_da*0.5
+    dr_dkex = dr_dk0 - 1/den
+    dr_dgamma = c*0.5*gamma/a
+    # T = |r|**2, so dT/dp = 2 Re(conj(r) dr/dp)
+    rc = 2*amp*np.conj(r)
+    jac = np.empty((d.size, 6))
+    jac[:,0] = np.real(rc*dr_dd0)
+    jac[:,1] = 1.
+    jac[:,2] = np.abs(r)**2
+    jac[:,3] = np.real(rc*dr_dk0)
+    jac[:,4] = np.real(rc*dr_dkex)
+    jac[:,5] = np.real(rc*dr_dgamma)
+    return jac
+
+###################### Initial Guesses ###############################
+
+def smooth(y, width):
+    """
+    smooth(y, width)
+
+    Moving average of y over width points, computed from a cumulative sum so
+    the cost does not depend on width.  The ends are padded with the edge
+    values so the result has the same length as y.
+
+    Args:
+        y : array
+            data to smooth
+        width : int
+            number of points to average over
+
+    Returns:
+        array : smoothed y
+    """
+    width = int(width)
+    if width <= 1:
+        return np.asarray(y, dtype=float)
+    pad = width//2
+    yp = np.pad(np.asarray(y, dtype=float), (pad, width - 1 - pad),
+        mode='edge')
+    c = np.cumsum(yp)
+    c = np.concatenate(([0.], c))
+    return (c[width:] - c[:-width])/width
+
+def _half_width(x, ys, i, level):
+    # Interpolated x positions where ys first drops below level walking out
+    # from index i on either side.  Only the region connected to the peak is
+    # considered, so noise crossing level elsewhere does not matter.
+    below = np.flatnonzero(ys < level)
+    k = np.searchsorted(below, i)
+    if k > 0:
+        lo = below[k - 1]
+        xl = np.interp(level, (ys[lo], ys[lo + 1]), (x[lo], x[lo + 1]))
+    else:
+        xl = x[0]
+    if k < len(below):
+        hi = below[k]
+        xr = np.interp(level, (ys[hi], ys[hi - 1]), (x[hi], x[hi - 1]))
+    else:
+        xr = x[-1]
+    return xl, xr
+
+def _vertex(x, ys, i):
+    # Sub-sample peak position from a parabola through the three points
+    # around index i
+    if i == 0 or i == len(ys) - 1:
+        return x[i]
+    den = ys[i - 1] - 2*ys[i] + ys[i + 1]
+    if den == 0:
+        return x[i]
+    shift = 0.5*(ys[i - 1] - ys[i + 1])/den
+    return x[i] + shift*(x[i + 1] - x[i - 1])*0.5
+
+def triplet_guess(x_data, y_data, inverted=False, width=None, exclude=3.0):
+    """
+    triplet_guess(x_data, y_data, inverted=False, width=None, exclude=3.0)
+
+    Initial guesses for fitting lorentzian_triplet to a carrier with two EOM
+    sidebands.  The data is smoothed once, all local maxima are found in a
+    single vectorized pass, the largest is taken as the carrier and the
+    largest maximum on either side (outside exclude*fwhm of the carrier) as
+    the sidebands.  Widths are measured on the smoothed data around each
+    peak only, so noisy data with several half max crossings is handled.
+
+    Args:
+        x_data : array
+            x-axis values, sorted
+        y_data : array
+            y-axis values
+        inverted : bool, optional
+            True for dips (e.g. a transmission measurement) instead of peaks
+        width : int, optional
+            points in the smoothing window.  Defaults to len(y_data)//200.
+        exclude : float, optional
+            sidebands are searched for further than exclude*fwhm from the
+            carrier.  Default is 3.
+
+    Returns:
+        list : [x0,y0,amp,fwhm,xl,ampl,fwhml,xr,ampr,fwhmr] in the order of
+            the lorentzian_triplet arguments
+    """
+    x = np.asarray(x_data, dtype=float)
+    sign = -1. if inverted else 1.
+    if width is None:
+        width = len(x)//200
+    ys = sign*smooth(y_data, width)
+    y0 = np.median(ys)
+
+    # Every local maximum of the smoothed data
+    peaks = np.flatnonzero((ys[1:-1] > ys[:-2]) & (ys[1:-1] >= ys[2:])) + 1
+    c = np.argmax(ys)
+    amp = ys[c] - y0
+    xl_half, xr_half = _half_width(x, ys, c, y0 + 0.5*amp)
+    fwhm = xr_half - xl_half
+    x0 = _vertex(x, ys, c)
+
+    span = np.abs(x[-1] - x[0])
+    guess = [x0, y0, amp, fwhm]
+    for side in (-1, 1):
+        dist = side*(x[peaks] - x0)
+        candidates = peaks[dist > exclude*fwhm]
+        if len(candidates):
+            i = candidates[np.argmax(ys[candidates])]
+            ampi = ys[i] - y0
+            lo, hi = _half_width(x, ys, i, y0 + 0.5*ampi)
+            # The sidebands probe the same mode as the carrier, so they can't
+            # be wider.  Noise tends to inflate the width of small sidebands.
+            fwhmi = min(hi - lo, fwhm) if hi > lo else fwhm
+            guess += [_vertex(x, ys, i), ampi, fwhmi]
+        else:
+            guess += [x0 + side*0.25*span, 0.1*amp, fwhm]
+    # Bring offset and amplitudes back to the sign of the data
+    for k in (1, 2, 5, 8):
+        guess[k] *= sign
+    return guess
+
 ###################### Fitting ###############################
 
 def fit_lorentzian(x_data, y_data, x0=None, y0=None, amp=None, fwhm=None,
-        bounds=(-np.inf, np.inf)):
+        bounds=(-np.inf, np.inf), jac=lorentzian_jac):
+    # jac=None falls back to finite difference derivatives
+    from scipy.optimize import curve_fit
     if x0 is None:
         x0 = x_data[np.argmax(y_data)]
     if y0 is None:
@@ -121,7 +349,7 @@ def fit_lorentzian(x_data, y_data, x0=None, y0=None, amp=None, fwhm=None,
     if fwhm is None:
         fwhm = 0.2*np.abs((x_data[-1] - x_data[0]))
     popt, pcov = curve_fit(lorentzian, x_data, y_data, p0=[x0,y0,amp,fwhm],
-        bounds=bounds)
+        bounds=bounds, jac=jac)
     return popt, pcov
 
 def print_lorentzian_fit(popt, units=('','','','')):
@@ -134,73 +362,52 @@ def print_lorentzian_fit(popt, units=('','','','')):
 
 def fit_lorentzian_triplet(x_data, y_data, x0=None, y0=None, amp=None,
     fwhm=None, xl=None, ampl=None, fwhml=None,
-    xr=None, ampr=None,fwhmr=None, inverted=False):
-    # If all paramaters are None, assume a large center peak with small,
-    # resolved sidebands
-    if not any([x0,y0,amp,fwhm,xl,ampl,fwhml,xr,ampr,fwhmr]) and not inverted:
-        x0 = x_data[y_data==np.max(y_data)][0]
-        y0 = np.min(y_data)
-        amp = np.max(y_data) - np.min(y_data)
-        half_max = y_data > y0 + 0.5*amp
-        fwhm = x_data[half_max][-1] - x_data[half_max][0]
-        left_filt = x_data < x0 - 3.0*fwhm
-        right_filt = x_data > x0 + 3.0*fwhm
-        x_datal = x_data[left_filt]
-        x_datar = x_data[right_filt]
-        y_datal = y_data[left_filt]
-        y_datar = y_data[right_filt]
-        xl = x_datal[y_datal==np.max(y_datal)][0]
-        xr = x_datar[y_datar==np.max(y_datar)][0]
-        ampl = np.max(y_datal) - np.min(y_datal)
-        ampr = np.max(y_datar) - np.min(y_datar)
-        popt, pcov = curve_fit(lorentzian_triplet,x_data,y_data,
-            [x0,y0,amp,fwhm,xl,ampl,fwhm,xr,ampr,fwhm])
-        return popt, pcov
-
-    elif not any([x0,y0,amp,fwhm,xl,ampl,fwhml,xr,ampr,fwhmr]) and inverted:
-        x0 = x_data[y_data==np.min(y_data)][0]
-        y0 = np.max(y_data)
-        amp = np.max(y_data) - np.min(y_data)
-        half_max = y_data < y0 - 0.5*amp
-        fwhm = x_data[half_max][-1] - x_data[half_max][0]
-        left_filt = x_data < x0 - 2*fwhm
-        right_filt = x_data > x0 + 2*fwhm
-        x_datal = x_data[left_filt]
-        x_datar = x_data[right_filt]
-        y_datal = y_data[left_filt]
-        y_datar = y_data[right_filt]
-        xl = x_datal[y_datal==np.min(y_datal)][0]
-        xr = x_datar[y_datar==np.min(y_datar)][0]
-        ampl = np.max(y_datal) - np.min(y_datal)
-        ampr = np.max(y_datar) - np.min(y_datar)
-        popt, pcov = curve_fit(lorentzian_triplet,x_data,y_data,
-            [x0,y0,amp,fwhm,xl,ampl,fwhm,xr,ampr,fwhm])
-        return popt, pcov
-
-    else:
-        if x0 is None:
-            x0 = x_data[np.argmax(y_data)]
-        if y0 is None:
-            y0 = np.amin(y_data)
-        if amp is None:
-            amp = np.amax(y_data) - np.amin(y_data)
-        if fwhm is None:
-            fwhm = 0.05*np.abs((x_data[-1] - x_data[0]))
-        if xl is None:
-            xl = x0 - 0.25*np.abs(x_data[-1] - x_data[0])
-        if ampl is None:
-            ampl = .1*amp
+    xr=None, ampr=None,fwhmr=None, inverted=False, jac=lorentzian_triplet_jac):
+    # Parameters that are not given are estimated by triplet_guess, which
+    # assumes a large center peak (or dip, if inverted) with small, resolved
+    # sidebands
+    from scipy.optimize import curve_fit
+    given = [x0,y0,amp,fwhm,xl,ampl,fwhml,xr,ampr,fwhmr]
+    p0 = triplet_guess(x_data, y_data, inverted)
+    for i in range(len(given)):
+        if given[i] is not None:
+            p0[i] = given[i]
+    # Sidebands inherit the carrier width if only the carrier width is given
+    if fwhm is not None:
         if fwhml is None:
-            fwhml = fwhm
-        if xr is None:
-            xr = x0 - 0.25*np.abs(x_data[-1] - x_data[0])
-        if ampr is None:
-            ampr = .1*amp
+            p0[6] = fwhm
         if fwhmr is None:
-            fwhmr = fwhm
-        popt, pcov = curve_fit(lorentzian_triplet,x_data,y_data,
-            [x0,y0,amp,fwhm,xl,ampl,fwhml,xr,ampr,fwhmr])
-        return popt, pcov
+            p0[9] = fwhm
+    popt, pcov = curve_fit(lorentzian_triplet,x_data,y_data,p0,jac=jac)
+    return popt, pcov
+
+def fit_optical_doublet(x_data, y_data, p0, bounds=(-np.inf, np.inf),
+        jac=optical_doublet_fit_jac):
+    """
+    fit_optical_doublet(x_data, y_data, p0, bounds=(-np.inf, np.inf),
+        jac=optical_doublet_fit_jac)
+
+    Least squares fit of optical_doublet_fit to data.
+
+    Args:
+        x_data : array
+            detuning axis
+        y_data : array
+            transmission data
+        p0 : sequence
+            initial guess for (d0, off, amp, k0, kex, gamma)
+        bounds : tuple, optional
+            bounds passed to curve_fit
+        jac : callable, optional
+            Jacobian of the model.  None uses finite differences.
+
+    Returns:
+        tuple : popt, pcov from curve_fit
+    """
+    from scipy.optimize import curve_fit
+    popt, pcov = curve_fit(optical_doublet_fit, x_data, y_data, p0=p0,
+        bounds=bounds, jac=jac)
+    return popt, pcov
 
 ###################Optical Mode Analysis##########################
 
@@ -224,6 +431,87 @@ def get_linewidth(x,y,eom_frequency,invert=True):
     popt, pcov = fit_lorentzian(xcal,y,x0=0) # Central peak at x=0 
     return popt[-1]
 
+
+###################### Phase Noise ###############################
+
+def _power_law_integral(f, s, f_lo, f_hi):
+    # Integral of s over [f_lo, f_hi], with s taken as a power law of f
+    # between points (a straight line on the log-log plot), the way phase
+    # noise analyzers integrate.  f_lo and f_hi may be arrays of ranges.
+    f = np.asarray(f, dtype=float)
+    s = np.asarray(s, dtype=float)
+    a = np.diff(np.log(s))/np.diff(np.log(f))
+    def partial(k, b):
+        # Integral from f[k] to b within segment k
+        p = a[k] + 1
+        r = b/f[k]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(np.abs(p) > 1e-9, s[k]*f[k]*(r**p - 1)/p,
+                            s[k]*f[k]*np.log(r))
+    segments = np.arange(len(a))
+    cumulative = np.concatenate(([0.], np.cumsum(partial(segments, f[1:]))))
+    def at(b):
+        b = np.clip(np.asarray(b, dtype=float), f[0], f[-1])
+        k = np.clip(np.searchsorted(f, b, 'right') - 1, 0, len(a) - 1)
+        return cumulative[k] + partial(k, b)
+    return at(f_hi) - at(f_lo)
+
+def integrated_phase_noise(f, l_dbc, f_min=None, f_max=None):
+    """
+    integrated_phase_noise(f, l_dbc, f_min=None, f_max=None)
+
+    Integrated single sideband phase noise over a range of offsets.
+
+    Args:
+        f (array) : offset frequencies in Hz, increasing
+        l_dbc (array) : phase noise L(f) in dBc/Hz
+        f_min (float or array, optional) : start of the range, defaults to
+            the first offset.  Arrays give several ranges at once.
+        f_max (float or array, optional) : end of the range, defaults to
+            the last offset
+
+    Returns:
+        float or array : integrated phase noise in dBc
+    """
+    if f_min is None:
+        f_min = f[0]
+    if f_max is None:
+        f_max = f[-1]
+    return log(_power_law_integral(f, unlog(np.asarray(l_dbc)), f_min,
+                                   f_max))
+
+def rms_phase(f, l_dbc, f_min=None, f_max=None):
+    """
+    rms_phase(f, l_dbc, f_min=None, f_max=None)
+
+    RMS phase deviation, sqrt(2 * integral of L(f)), over a range of offsets.
+    Arguments as for integrated_phase_noise.
+
+    Returns:
+        float or array : rms phase in radians
+    """
+    return np.sqrt(2*unlog(integrated_phase_noise(f, l_dbc, f_min, f_max)))
+
+def rms_jitter(f, l_dbc, carrier_frequency, f_min=None, f_max=None):
+    """
+    rms_jitter(f, l_dbc, carrier_frequency, f_min=None, f_max=None)
+
+    RMS timing jitter over a range of offsets.  Arguments as for
+    integrated_phase_noise.
+
+    Args:
+        carrier_frequency (float) : carrier frequency in Hz
+
+    Returns:
+        float or array : rms jitter in seconds
+
+    Examples:
+        >>> f, l, meta = pxa.fetch_phasenoise(1)
+        >>> rms_jitter(f, l, meta['carrier_frequency'], [1e3, 1e4],
+        ...            [1e6, 1e7])
+    """
+    return rms_phase(f, l_dbc, f_min, f_max)/(2*np.pi*carrier_frequency)
+
     
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
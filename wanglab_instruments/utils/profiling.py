@@ -0,0 +1,388 @@
+from __future__ import print_function
+import importlib
+import marshal
+import threading
+import time
+import types
+
+###################### Profiling ###############################
+#
+# Opt-in timing of the driver classes and fit helpers.  enable() wraps the
+# public methods and properties of every driver class and the helpers fit_*
+# functions.  Every call is timed, and the time spent inside the
+# communication object (write, query, read_bytes, ...) is counted separately
+# as bus I/O, together with the bytes moved.  disable() restores the
+# originals, so nothing is slowed down unless profiling was asked for.
+
+_driver_modules = ('oscilloscopes', 'spectrum_analyzers', 'lockins',
+                   'function_generators')
+
+# Communication methods timed as bus I/O
+_io_methods = ('write', 'read', 'query', 'write_raw', 'read_raw',
+               'read_bytes', 'read_into', 'query_ascii_values',
+               'query_binary_values', 'write_binary_values',
+               'write_ascii_values', 'read_stb', 'assert_trigger',
+               'wait_for_srq', 'clear', 'query_pipelined')
+
+def _size(obj):
+    # Approximate bytes in a message or response
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    nbytes = getattr(obj, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    if isinstance(obj, (list, tuple)):
+        return 8*len(obj)
+    return 0
+
+class _IOProxy(object):
+    # Stand-in for a communication object that times the I/O methods
+    def __init__(self, resource, profiler):
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, 'profiler', profiler)
+
+    def __repr__(self):
+        return repr(self.resource)
+
+    def __getattr__(self, name):
+        attr = getattr(self.resource, name)
+        if name not in _io_methods or not callable(attr):
+            return attr
+        profiler = self.profiler
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            result = attr(*args, **kwargs)
+            nbytes = sum(_size(a) for a in args)
+            if name == 'read_into':
+                nbytes = result
+            elif name not in ('write', 'write_raw', 'write_binary_values',
+                              'write_ascii_values'):
+                nbytes += _size(result)
+            profiler._io(time.perf_counter() - t0, nbytes)
+            return result
+        timed.__name__ = name
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self.resource, name, value)
+
+def _original(module, name):
+    # The unprofiled function a _Profiled unpickles to
+    func = getattr(importlib.import_module(module), name)
+    while isinstance(func, _Profiled):
+        func = func.__wrapped__
+    return func
+
+class _Profiled(object):
+    # Profiled version of a function, see Profiler.wrap.  A class rather than
+    # a closure so that a profiled fit helper can still be sent to the worker
+    # processes of batch_fit, which get the original function.
+    def __init__(self, profiler, func, name):
+        code = getattr(func, '__code__', None)
+        self.key = (getattr(code, 'co_filename', '~'),
+                    getattr(code, 'co_firstlineno', 0), name)
+        self.profiler = profiler
+        self.__wrapped__ = func
+        self.__name__ = getattr(func, '__name__', name)
+        self.__doc__ = getattr(func, '__doc__', None)
+        self.__module__ = getattr(func, '__module__', None)
+
+    def __repr__(self):
+        return '<profiled {!r}>'.format(self.__wrapped__)
+
+    def __get__(self, obj, cls=None):
+        # Bind like a function when used as a method
+        if obj is None:
+            return self
+        return types.MethodType(self, obj)
+
+    def __reduce__(self):
+        return (_original, (self.__module__, self.__name__))
+
+    def __call__(self, *args, **kwargs):
+        profiler = self.profiler
+        stack = profiler._stack()
+        # [bus I/O time, bytes, time in nested profiled calls]
+        frame = [0., 0, 0.]
+        stack.append(frame)
+        t0 = time.perf_counter()
+        try:
+            return self.__wrapped__(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            stack.pop()
+            if stack:
+                stack[-1][2] += elapsed
+            with profiler._lock:
+                entry = profiler.stats.setdefault(self.key, [0, 0., 0., 0., 0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] += elapsed - frame[2]
+                entry[3] += frame[0]
+                entry[4] += frame[1]
+
+class Profiler(object):
+    """
+    Initialize Profiler class object
+
+    Call counts and times of profiled methods.  For every method the time is
+    split into bus I/O (inside the communication object) and host compute
+    (everything else), and the bytes moved over the bus are counted.  Times
+    are inclusive of nested profiled calls, e.g. the get_start_freq query
+    inside Tek5103.fetch_spectrum also counts toward fetch_spectrum.
+
+    Examples:
+        >>> from wanglab_instruments.utils import profiling
+        >>> with profiling.Profiler() as prof:
+        ...     for i in range(100):
+        ...         rsa.fetch_spectrum(1)
+        >>> print(prof.report())
+        >>> prof.dump_stats('run.prof') # for pstats or snakeviz
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return 'Profiler({} methods)'.format(len(self.stats))
+
+    def __enter__(self):
+        enable(self)
+        return self
+
+    def __exit__(self, *exc):
+        disable()
+        return False
+
+    def reset(self):
+        """Discard the statistics collected so far."""
+        with self._lock:
+            self.stats = {}
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _io(self, elapsed, nbytes):
+        # Bus I/O counts toward every profiled call in progress
+        for frame in self._stack():
+            frame[0] += elapsed
+            frame[1] += nbytes
+
+    def wrap(self, func, name):
+        """
+        wrap(self, func, name)
+
+        Profiled version of a function.
+
+        Args:
+            func (callable) : function to time
+            name (str) : name to report it under, e.g. 'Tek5103.fetch_spectrum'
+
+        Returns:
+            callable : the wrapper.  The original is its __wrapped__
+                attribute.
+        """
+        return _Profiled(self, func, name)
+
+    def resource(self, inst):
+        """
+        resource(self, inst)
+
+        Communication object that records its I/O time and bytes with this
+        profiler.  A session LockedResource keeps its locks.
+        """
+        from ..instruments.session import LockedResource
+        if isinstance(inst, LockedResource):
+            locked = LockedResource.__new__(LockedResource)
+            for name in ('lock', 'bus', 'priority', 'device_lock'):
+                object.__setattr__(locked, name, getattr(inst, name))
+            object.__setattr__(locked, 'resource',
+                               _IOProxy(inst.resource, self))
+            return locked
+        return _IOProxy(inst, self)
+
+    def rows(self, sort='total'):
+        """
+        rows(self, sort='total')
+
+        Statistics as a list of dicts with keys name, calls, total, per_call,
+        own, io, compute and bytes (times in seconds), sorted by the given
+        key, largest first.
+        """
+        with self._lock:
+            items = list(self.stats.items())
+        rows = []
+        for (filename, line, name), (calls, total, own, io, nbytes) in items:
+            rows.append({'name': name, 'calls': calls, 'total': total,
+                         'per_call': total/calls, 'own': own, 'io': io,
+                         'compute': total - io, 'bytes': nbytes})
+        rows.sort(key=lambda r: r[sort], reverse=sort != 'name')
+        return rows
+
+    def report(self, sort='total', limit=None):
+        """
+        report(self, sort='total', limit=None)
+
+        Table of the statistics.
+
+        Args:
+            sort (str, optional) : column to sort by, see rows
+            limit (int, optional) : number of rows to show
+
+        Returns:
+            str : the table
+        """
+        lines = ['{:>8} {:>10} {:>10} {:>10} {:>10} {:>12}  {}'.format(
+            'calls', 'total s', 'ms/call', 'bus I/O s', 'compute s', 'bytes',
+            'method')]
+        for r in self.rows(sort)[:limit]:
+            lines.append('{:>8} {:>10.4f} {:>10.3f} {:>10.4f} {:>10.4f} '
+                         '{:>12}  {}'.format(r['calls'], r['total'],
+                         1000*r['per_call'], r['io'], r['compute'],
+                         r['bytes'], r['name']))
+        return '\n'.join(lines)
+
+    def dump_stats(self, filename):
+        """
+        dump_stats(self, filename)
+
+        Save the statistics in the format of cProfile, for pstats.Stats or
+        viewers such as snakeviz.  Bus I/O is not part of that format, see
+        report.
+        """
+        with self._lock:
+            stats = dict((key, (calls, calls, own, total, {}))
+                         for key, (calls, total, own, io, nbytes)
+                         in self.stats.items())
+        with open(filename, 'wb') as f:
+            marshal.dump(stats, f)
+
+# Replaced attributes as (owner, name, original), for disable
+_patched = []
+_active = None
+
+def _patch(owner, name, value):
+    _patched.append((owner, name, owner.__dict__.get(name)))
+    setattr(owner, name, value)
+
+def _inst_property(profiler):
+    # Data descriptor that hands the driver methods an I/O timing proxy of
+    # the communication object, while the instance keeps the original
+    def get(self):
+        try:
+            raw = self.__dict__['inst']
+        except KeyError:
+            raise AttributeError('{!r} object has no attribute '
+                                 "'inst'".format(type(self).__name__))
+        cached = self.__dict__.get('_profiled_inst')
+        if cached is None or cached[0] is not raw:
+            cached = (raw, profiler.resource(raw))
+            self.__dict__['_profiled_inst'] = cached
+        return cached[1]
+    def set(self, value):
+        self.__dict__['inst'] = value
+        self.__dict__.pop('_profiled_inst', None)
+    return property(get, set)
+
+def profile_class(cls, profiler):
+    """
+    profile_class(cls, profiler)
+
+    Profile the public methods and properties defined by a class, and the
+    I/O of its instances' inst attribute.  Undone by disable.
+    """
+    for name, value in list(cls.__dict__.items()):
+        if name.startswith('_'):
+            continue
+        qualified = '{}.{}'.format(cls.__name__, name)
+        if isinstance(value, property):
+            wrapped = property(
+                value.fget and profiler.wrap(value.fget, qualified),
+                value.fset and profiler.wrap(value.fset, qualified + '='),
+                value.fdel, value.__doc__)
+            _patch(cls, name, wrapped)
+        elif isinstance(value, types.FunctionType):
+            _patch(cls, name, profiler.wrap(value, qualified))
+    _patch(cls, 'inst', _inst_property(profiler))
+
+def driver_classes():
+    """
+    driver_classes()
+
+    Every class defined in the driver modules.
+
+    Returns:
+        list of type : the classes
+    """
+    classes = []
+    for module in _driver_modules:
+        module = importlib.import_module('wanglab_instruments.instruments.'
+                                         + module)
+        for value in vars(module).values():
+            if isinstance(value, type) and value.__module__ == module.__name__:
+                classes.append(value)
+    return classes
+
+def enable(profiler=None, classes=None, fits=True):
+    """
+    enable(profiler=None, classes=None, fits=True)
+
+    Start profiling.  Only one profiler is active at a time; enabling again
+    disables the previous one first.
+
+    Args:
+        profiler (Profiler, optional) : where to record, a new one by default
+        classes (list of type, optional) : classes to profile, default every
+            driver class, see driver_classes
+        fits (bool, optional) : also profile the helpers fit_* functions.
+            Only calls looked up through the helpers module are seen, not
+            references taken before enable (e.g. from helpers import ...).
+            Fits run by batch_fit worker processes are not timed.
+
+    Returns:
+        Profiler : the active profiler
+    """
+    global _active
+    disable()
+    if profiler is None:
+        profiler = Profiler()
+    if classes is None:
+        classes = driver_classes()
+    for cls in classes:
+        profile_class(cls, profiler)
+    if fits:
+        from . import helpers
+        for name, value in list(vars(helpers).items()):
+            if name.startswith('fit_') and callable(value):
+                _patch(helpers, name,
+                       profiler.wrap(value, 'helpers.' + name))
+    _active = profiler
+    return profiler
+
+def disable():
+    """
+    disable()
+
+    Stop profiling and restore the original methods.
+
+    Returns:
+        Profiler : the profiler that was active, or None
+    """
+    global _active
+    while _patched:
+        owner, name, original = _patched.pop()
+        if original is None:
+            delattr(owner, name)
+        else:
+            setattr(owner, name, original)
+    profiler, _active = _active, None
+    return profiler
+
+def active():
+    """The active Profiler, or None"""
+    return _active
@@ -0,0 +1,254 @@
+from __future__ import print_function
+import hashlib
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .checkpoint import Checkpoint, snapshot_of
+
+###################### Parameter Scans ###############################
+
+def snake_order(shape):
+    """
+    snake_order(shape)
+
+    Multi-indices covering an array of the given shape, ordered so that
+    consecutive points differ in a single index by one step.  The first
+    dimension changes least often, and every inner dimension reverses
+    direction on alternate passes (boustrophedon order), so a scan never
+    jumps back to the start of an inner axis.
+
+    Args:
+        shape (tuple of int) : size of every dimension
+
+    Returns:
+        list of tuple : multi-indices in scan order
+    """
+    order = [()]
+    for n in reversed(shape):
+        order = [(i,) + rest
+                 for i in range(n)
+                 for rest in (order if i % 2 == 0 else order[::-1])]
+    return order
+
+class Scan(object):
+    """
+    Initialize Scan class object
+
+    A declarative multi-dimensional scan over existing instrument properties.
+    Every axis is an (instrument, property name, values) tuple, optionally
+    with a fourth element giving the relative cost of changing that property
+    (e.g. a generator retune that needs settling time).  Axes are nested by
+    cost, the most expensive outermost, and visited in snake order so that
+    every step changes as few and as cheap settings as possible.  When several
+    settings change at once, settings on different instruments are made
+    concurrently.
+
+    Args:
+        axes (list of tuple) : (instrument, property, values[, cost])
+        measure (callable or list of callables) : called with no arguments at
+            every point, returning a number or an array (e.g.
+            lambda: rsa.fetch_spectrum(1)[1]).  Several measurements are run
+            concurrently.
+        callback (callable, optional) : called as callback(index, results)
+            after every point, with the index into the data arrays
+
+    Examples:
+        >>> scan = Scan([(hp, 'frequency', np.linspace(90, 110, 21), 10),
+        ...              (afg, 'vmax', np.linspace(.1, 1, 10))],
+        ...             lambda: lockin.read_xy())
+        >>> data = scan.run()
+        >>> data.shape
+        (21, 10, 2)
+    """
+
+    def __init__(self, axes, measure, callback=None):
+        self.axes = []
+        for axis in axes:
+            if len(axis) == 3:
+                axis = tuple(axis) + (1.,)
+            inst, prop, values, cost = axis
+            self.axes.append((inst, prop, np.asarray(values), float(cost)))
+        self.measure = measure
+        self.callback = callback
+        self.data = None
+        self._checkpoint = None
+
+    def __repr__(self):
+        return 'Scan({!r}, {!r})'.format(
+            [(inst, prop, len(values), cost)
+             for inst, prop, values, cost in self.axes], self.measure)
+
+    @property
+    def shape(self):
+        """number of values on every axis, in the order the axes were given"""
+        return tuple(len(values) for inst, prop, values, cost in self.axes)
+
+    def nesting(self):
+        """
+        nesting(self)
+
+        Order in which the axes are nested, outermost (most expensive) first.
+        Axes of equal cost keep the order they were given in.
+
+        Returns:
+            list of int : axis numbers
+        """
+        return sorted(range(len(self.axes)), key=lambda i: -self.axes[i][3])
+
+    def points(self):
+        """
+        points(self)
+
+        Points of the scan in the order they will be measured.
+
+        Returns:
+            list of tuple : indices into the axis values, in the order the
+                axes were given
+        """
+        nest = self.nesting()
+        shape = [self.shape[i] for i in nest]
+        points = []
+        for nested in snake_order(shape):
+            index = [0]*len(nest)
+            for i, n in zip(nest, nested):
+                index[i] = n
+            points.append(tuple(index))
+        return points
+
+    def _settings(self, index, previous):
+        # Settings to make to move from previous to index, grouped by
+        # instrument so one instrument never sees concurrent commands
+        groups = []
+        for i, (inst, prop, values, cost) in enumerate(self.axes):
+            if previous is not None and previous[i] == index[i]:
+                continue
+            value = values[index[i]]
+            if hasattr(value, 'item'):
+                value = value.item()
+            for group in groups:
+                if group[0] is inst:
+                    group[1].append((prop, value))
+                    break
+            else:
+                groups.append((inst, [(prop, value)]))
+        return groups
+
+    @staticmethod
+    def _apply(group):
+        inst, settings = group
+        for prop, value in settings:
+            setattr(inst, prop, value)
+
+    def _store(self, index, results):
+        if self.data is None:
+            if self._checkpoint is None:
+                self.data = [np.full(self.shape + np.shape(r), np.nan)
+                             for r in results]
+            else:
+                self.data = [self._checkpoint.array('data{}'.format(i),
+                                                    self.shape + np.shape(r))
+                             for i, r in enumerate(results)]
+        for data, r in zip(self.data, results):
+            data[index] = r
+
+    def _meta(self, points=None):
+        # Description of the scan recorded in a checkpoint, used to refuse
+        # resuming a checkpoint made by a different scan.  The points follow
+        # from the axes and nesting; a custom list of points is recorded by
+        # its digest, since the progress file is rewritten after every point.
+        meta = {'axes': [[prop, values.tolist()]
+                         for inst, prop, values, cost in self.axes],
+                'shape': list(self.shape), 'nesting': self.nesting()}
+        if points is not None:
+            points = json.dumps([[int(i) for i in p] for p in points])
+            meta['points'] = hashlib.sha1(points.encode()).hexdigest()
+        return meta
+
+    def run(self, points=None, checkpoint=None):
+        """
+        run(self, points=None, checkpoint=None)
+
+        Run the scan.  Results are streamed into self.data as they arrive, so
+        partial data is available from another thread or after an error.
+
+        With a checkpoint, data is streamed into memory-mapped arrays in the
+        checkpoint directory and progress is recorded after every point.
+        Running again with the same checkpoint resumes after the last
+        completed point.
+
+        Args:
+            points (list of tuple, optional) : points to measure, defaults to
+                self.points()
+            checkpoint (str or Checkpoint, optional) : checkpoint directory
+
+        Returns:
+            array : data of shape self.shape + measurement shape.  A list of
+                arrays if measure is a list of callables.
+        """
+        custom = points
+        if points is None:
+            points = self.points()
+        measures = self.measure
+        if callable(measures):
+            measures = [measures]
+        workers = max(len(measures),
+                      len(set(id(axis[0]) for axis in self.axes)))
+        start = 0
+        self._checkpoint = None
+        if checkpoint is not None:
+            if not isinstance(checkpoint, Checkpoint):
+                checkpoint = Checkpoint(checkpoint)
+            instruments = []
+            for inst, prop, values, cost in self.axes:
+                if all(inst is not i for i in instruments):
+                    instruments.append(inst)
+            start = checkpoint.start(self._meta(custom),
+                [snapshot_of(inst) for inst in instruments])
+            self._checkpoint = checkpoint
+            self.data = None
+            if start:
+                # Reopen the partial data written before the interruption
+                self.data = []
+                while checkpoint.has_array('data{}'.format(len(self.data))):
+                    self.data.append(
+                        checkpoint.array('data{}'.format(len(self.data))))
+        previous = None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for k in range(start, len(points)):
+                index = points[k]
+                groups = self._settings(index, previous)
+                if len(groups) == 1:
+                    self._apply(groups[0])
+                else:
+                    list(pool.map(self._apply, groups))
+                if len(measures) == 1:
+                    results = [measures[0]()]
+                else:
+                    results = list(pool.map(lambda m: m(), measures))
+                self._store(index, results)
+                if self.callback is not None:
+                    self.callback(index, results)
+                if self._checkpoint is not None:
+                    self._checkpoint.commit(k + 1)
+                previous = index
+        if self._checkpoint is not None:
+            self._checkpoint.finish()
+        if callable(self.measure):
+            return self.data[0]
+        return self.data
+
+if __name__ == '__main__':
+    class Knob(object):
+        def __init__(self, name):
+            self.name = name
+            self.value = 0
+            self.changes = 0
+        def __setattr__(self, key, value):
+            if key == 'value':
+                self.__dict__['changes'] = self.__dict__.get('changes', 0) + 1
+            object.__setattr__(self, key, value)
+    a, b = Knob('a'), Knob('b')
+    scan = Scan([(a, 'value', range(3)), (b, 'value', range(4), 10)],
+                lambda: a.value + 10*b.value)
+    print(scan.run())
+    print('changes: a {}, b {}'.format(a.changes, b.changes))